@@ -0,0 +1,191 @@
+#! /usr/bin/env python
+__author__  = "Marco Mariotti"
+__email__   = "marco.mariotti@ub.edu"
+
+import sys, os, subprocess, json, time, platform, resource, shutil, tempfile
+from easyterm import command_line_options, write, NoTracebackError
+
+help_msg="""bench_qjob: measure how qjob scales in generating and submitting jobs
+
+#### Usage:   python benchmarks/bench_qjob.py  [options]
+
+Synthetic workloads are created in a work folder: direct mode input files (-i) and template mode
+tables (-c/-d) with the numbers of rows requested. For each combination of mode, system, size and split,
+qjob main() is run in a separate process, so that its peak memory is measured alone. Then, the job
+files written are submitted with the same worker pool used by qjob -qsub, against stub qsub/sbatch
+executables which just print a job ID. Nothing is sent to a real queue.
+
+Results are saved in JSON format; use -compare with the file of a previous version to spot regressions.
+
+### Options:
+-rows      comma-separated numbers of input rows, e.g. 1000,10000,100000,1000000,10000000
+-modes     comma-separated input modes among: direct, template
+-sys       comma-separated systems among: sge, slurm
+-split     comma-separated splits of lines in jobs, as nlines:N or njobs:N
+-ms        submit only if the number of job files is up to this; 0 to never submit
+-sw        number of concurrent submission workers (as qjob -sw)
+-w         work folder for inputs, stubs and jobs folders (default: a temporary folder, deleted at the end)
+-o         output JSON file
+-compare   JSON file with results of a previous run; cases in common are compared and slowdowns reported
+-tol       slowdowns larger than this fraction are flagged as regressions in -compare
+"""
+
+def_opt={'rows':'1000,10000,100000',
+         'modes':'direct,template',
+         'sys':'sge,slurm',
+         'split':'nlines:1,nlines:100,njobs:1000',
+         'ms':20000,
+         'sw':8,
+         'w':'',
+         'o':'bench_results.json',
+         'compare':'',
+         'tol':0.1,
+         'case':''}   # internal: runs a single case, in the child process
+
+stub_script="""#!/bin/sh
+echo $$
+"""
+
+def create_stubs(bin_folder):
+  """Writes executables qsub and sbatch which accept any argument and print a job ID """
+  os.makedirs(bin_folder, exist_ok=True)
+  for name in ('qsub', 'sbatch'):
+    path=os.path.join(bin_folder, name)
+    with open(path, 'w') as fh:
+      fh.write(stub_script)
+    os.chmod(path, 0o755)
+
+def create_inputs(work_folder, mode, rows):
+  """Writes the input files of a synthetic workload, if not present. Returns a dict of qjob options to use them """
+  if mode=='direct':
+    path=os.path.join(work_folder, f'direct_{rows}.sh')
+    if not os.path.isfile(path):
+      with open(path, 'w') as ofh:
+        for i in range(rows):
+          ofh.write(f'echo processing item {i} > /dev/null\n')
+    return {'i':path}
+  elif mode=='template':
+    template=os.path.join(work_folder, 'template.sh')
+    table=os.path.join(work_folder, f'table_{rows}.tsv')
+    if not os.path.isfile(template):
+      with open(template, 'w') as ofh:
+        ofh.write('echo processing {sample} with {param} > /dev/null\n')
+    if not os.path.isfile(table):
+      with open(table, 'w') as ofh:
+        ofh.write('sample\tparam\n')
+        for i in range(rows):
+          ofh.write(f'sample{i}\t{i%7}\n')
+    return {'c':template, 'd':table}
+  raise NoTracebackError(f'bench_qjob ERROR unknown mode: {mode}')
+
+def run_case(case):
+  """Runs a single benchmark case in this process; returns a dict of measures """
+  from qjob.cli import main, def_opt as qjob_def_opt, read_manifest
+  from qjob.submission import submit_jobs
+
+  opt=dict(qjob_def_opt)
+  opt.update(case['inputs'])
+  key, value=case['split'].split(':')
+  opt.update({'sys':case['sys'], key:int(value), 'o':case['folder'], 'f':True, 'clean':True, 'q':'0', 'E':''})
+
+  start=time.perf_counter()
+  main(opt)
+  wall=time.perf_counter()-start
+  folder=case['folder']+'.jbs'
+  outfiles=[os.path.join(folder, f) for f in read_manifest(folder)]
+  measures={'n_jobs':len(outfiles),
+            'wall_s':round(wall, 3),
+            'job_files_per_s':round(len(outfiles)/wall, 1)}
+
+  if outfiles and len(outfiles)<=case['ms']:
+    start=time.perf_counter()
+    submitted=sum(1  for r in submit_jobs(outfiles, case['sys'], workers=case['sw'])  if not r.job_id is None)
+    submit_wall=time.perf_counter()-start
+    measures.update({'n_submitted':submitted,
+                     'submit_s':round(submit_wall, 3),
+                     'submissions_per_s':round(submitted/submit_wall, 1)})
+
+  measures['peak_rss_mb']=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024, 1)  # KB in linux
+  shutil.rmtree(folder)
+  return measures
+
+def case_key(record):
+  return (record['mode'], record['sys'], record['rows'], record['split'])
+
+def compare(results, previous_file, tolerance):
+  """Prints how results changed compared to those in previous_file; returns the number of regressions """
+  with open(previous_file) as fh:
+    previous=json.load(fh)
+  previous_cases={case_key(r):r for r in previous['results']}
+  write(f'\nComparison with {previous_file} (qjob v{previous["qjob_version"]} -> v{results["qjob_version"]}):')
+  n_regressions=0
+  for r in results['results']:
+    p=previous_cases.get(case_key(r))
+    if p is None: continue
+    for measure in ('job_files_per_s', 'submissions_per_s'):
+      if not measure in r or not measure in p: continue
+      change=r[measure]/p[measure]-1
+      flag=''
+      if change < -tolerance:
+        flag='  <-- REGRESSION'
+        n_regressions+=1
+      write(f'{" ".join(map(str, case_key(r))):<40} {measure:<18} {p[measure]:>10} -> {r[measure]:>10}  ({change:+.1%}){flag}')
+  return n_regressions
+
+def main():
+  opt=command_line_options(def_opt, help_msg)
+
+  if opt['case']:
+    # child process: stdout is discarded, results are written to a file
+    case=json.loads(opt['case'])
+    with open(case['result_file'], 'w') as fh:
+      json.dump(run_case(case), fh)
+    return
+
+  work_folder=opt['w'] if opt['w'] else tempfile.mkdtemp(prefix='bench_qjob_')
+  os.makedirs(work_folder, exist_ok=True)
+  bin_folder=os.path.join(work_folder, 'bin')
+  create_stubs(bin_folder)
+  env=dict(os.environ)
+  env['PATH']=bin_folder + os.pathsep + env['PATH']
+  src_folder=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+  env['PYTHONPATH']=src_folder + (os.pathsep + env['PYTHONPATH'] if env.get('PYTHONPATH') else '')
+  sys.path.insert(0, src_folder)   # benchmarking the qjob of this source tree, even if another is installed
+
+  from qjob._version import __version__
+  results={'qjob_version':__version__,
+           'python':platform.python_version(),
+           'platform':platform.platform(),
+           'date':time.strftime('%Y-%m-%d %H:%M:%S'),
+           'results':[]}
+  try:
+    for rows in [int(x) for x in str(opt['rows']).split(',')]:
+      for mode in opt['modes'].split(','):
+        inputs=create_inputs(work_folder, mode, rows)
+        for system in opt['sys'].split(','):
+          for split in opt['split'].split(','):
+            record={'mode':mode, 'sys':system, 'rows':rows, 'split':split}
+            case=dict(record, inputs=inputs, ms=opt['ms'], sw=opt['sw'],
+                      folder=os.path.join(work_folder, 'jobs'),
+                      result_file=os.path.join(work_folder, 'case_result.json'))
+            p=subprocess.run([sys.executable, os.path.abspath(__file__), '-case', json.dumps(case)],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, env=env)
+            if p.returncode!=0:
+              raise NoTracebackError(f'bench_qjob ERROR running case {record}:\n{p.stderr}')
+            with open(case['result_file']) as fh:
+              record.update(json.load(fh))
+            results['results'].append(record)
+            write(' '.join([f'{k}={v}' for k, v in record.items()]))
+  finally:
+    if not opt['w']:
+      shutil.rmtree(work_folder)
+
+  with open(opt['o'], 'w') as fh:
+    json.dump(results, fh, indent=1)
+  write(f'Results written to {opt["o"]}')
+
+  if opt['compare'] and compare(results, opt['compare'], opt['tol']):
+    raise NoTracebackError('bench_qjob: some measures are slower than in the previous run')
+
+if __name__ == '__main__':
+  main()
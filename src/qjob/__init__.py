@@ -1,2 +1,3 @@
 from ._version import __version__
 from .cli import main as run_qjob
+from .api import JobSpec, render_jobs, write_jobs, Submitter
@@ -0,0 +1,173 @@
+__author__  = "Marco Mariotti"
+__email__   = "marco.mariotti@ub.edu"
+
+import subprocess, getpass, math
+from more_itertools import chunked
+
+#### resource usage of finished jobs, read from the accounting of the scheduler with a single call for all jobs
+#### (for slurm, one call per sacct_chunk_size jobs, to keep the command line within the size allowed by the system)
+sacct_chunk_size=2000
+
+class JobUsage(object):
+  """ Resources used by a finished job (or array task), as recorded by the scheduler accounting """
+  def __init__(self, sched_id, task_id=None):
+    self.sched_id=sched_id
+    self.task_id=task_id        # None for single jobs
+    self.state=None             # done or failed
+    self.exit_status=None
+    self.wall_seconds=0.0
+    self.cpu_seconds=0.0        # user + system time of all processes
+    self.max_rss_gb=0.0
+    self.ncpus=1
+
+  def __repr__(self):
+    return (f'JobUsage(sched_id={self.sched_id}, task_id={self.task_id}, state={self.state}, wall_seconds={self.wall_seconds}, '
+            f'cpu_seconds={self.cpu_seconds}, max_rss_gb={self.max_rss_gb}, ncpus={self.ncpus})')
+
+  @property
+  def cpu_efficiency(self):
+    """ Fraction of the allocated cpu time actually used; None if the job ran for no time """
+    if not self.wall_seconds:
+      return None
+    return self.cpu_seconds/(self.wall_seconds*self.ncpus)
+
+unfinished_slurm_states=('PENDING', 'RUNNING', 'REQUEUED', 'RESIZING', 'SUSPENDED', 'COMPLETING')
+
+size_units={'K':1/1024**2, 'M':1/1024, 'G':1, 'T':1024, 'P':1024**2}
+
+def parse_size_gb(value):
+  """ Parses a memory size as reported by sacct or qacct (e.g. 1234K, 2.5G, 512.000M, or bytes without unit); returns GB """
+  value=value.strip()
+  if not value:
+    return 0.0
+  if value[-1].upper() in size_units:
+    return float(value[:-1])*size_units[value[-1].upper()]
+  return float(value)/1024**3
+
+def parse_duration(value):
+  """ Parses a duration as reported by sacct (e.g. 1-02:03:04, 02:03:04, 03:04.123) or qacct (e.g. 123.456s); returns seconds """
+  value=value.strip().rstrip('s')
+  if not value:
+    return 0.0
+  days=0
+  if '-' in value:
+    days, value=value.split('-', 1)
+  seconds=0.0
+  for piece in value.split(':'):
+    seconds=seconds*60 + float(piece)
+  return int(days)*86400 + seconds
+
+def split_slurm_job_id(job_str):
+  """ Splits a sacct JobID like 123, 123_4, 123_4.batch, 123.extern into (sched_id, task_id, step); task_id and step may be None """
+  job_str, _, step=job_str.partition('.')
+  sched_id, _, task=job_str.partition('_')
+  task_id=int(task)  if task.isdigit() else  None
+  return sched_id, task_id, (step if step else None)
+
+def iter_qacct_records(text):
+  """ Yields a dict for each job record in the output of qacct -j, e.g. {'jobnumber':'123', 'taskid':'undefined', ...} """
+  fields=None
+  for line in text.split('\n'):
+    if line.startswith('===='):
+      if fields:
+        yield fields
+      fields={}
+    elif not fields is None and line.strip():
+      key, _, value=line.partition(' ')
+      fields[key]=value.strip()
+  if fields:
+    yield fields
+
+def query_accounting(system, sched_ids):
+  """ Gets the resources used by the finished jobs with the scheduler IDs provided, with a single call to sacct (slurm;
+  one per sacct_chunk_size jobs) or qacct (sge). Returns a dict with keys (sched_id, task_id) -- task_id is None for single jobs -- and JobUsage values """
+  usage={}
+  if not sched_ids:
+    return usage
+  if system=='slurm':
+    output=''
+    for chunk in chunked(sorted(sched_ids), sacct_chunk_size):
+      cmd=['sacct', '--parsable2', '--noheader', '--jobs', ','.join(chunk),
+           '--format', 'JobID,State,ExitCode,ElapsedRaw,TotalCPU,AllocCPUS,MaxRSS']
+      p=subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+      if p.returncode!=0:
+        raise Exception(f'\nWhile running command= {" ".join(cmd[:4])}... \nThere was ERROR= {p.stderr}')
+      output+=p.stdout
+    for line in output.split('\n'):
+      if not line.strip(): continue
+      job_str, state, exit_code, elapsed, total_cpu, ncpus, max_rss=line.split('|')
+      sched_id, task_id, step=split_slurm_job_id(job_str)
+      if not sched_id in sched_ids or (task_id is None and '_' in job_str):   # e.g. pending task ranges like 123_[5-10]
+        continue
+      job=usage.setdefault( (sched_id, task_id), JobUsage(sched_id, task_id) )
+      # max RSS is reported by job steps (e.g. batch); the other values by the job allocation line
+      job.max_rss_gb=max(job.max_rss_gb, parse_size_gb(max_rss))
+      if step is None and not state.split()[0] in unfinished_slurm_states:
+        job.exit_status=int(exit_code.split(':')[0])
+        job.state='done'  if (state=='COMPLETED' and job.exit_status==0) else  'failed'
+        job.wall_seconds=float(elapsed)
+        job.cpu_seconds=parse_duration(total_cpu)
+        job.ncpus=max(1, int(ncpus))
+    usage={k:job  for k, job in usage.items()  if not job.state is None}   # jobs not finished yet
+
+  elif system=='sge':
+    cmd=['qacct', '-o', getpass.getuser(), '-j']
+    p=subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if p.returncode!=0:
+      raise Exception(f'\nWhile running command= {" ".join(cmd)}\nThere was ERROR= {p.stderr}')
+    for fields in iter_qacct_records(p.stdout):
+      sched_id=fields.get('jobnumber')
+      if not sched_id in sched_ids:
+        continue
+      task_id=int(fields['taskid'])  if fields.get('taskid', '').isdigit() else  None
+      job=JobUsage(sched_id, task_id)
+      job.exit_status=int(fields.get('exit_status', '0').split()[0])
+      job.state='done'  if (job.exit_status==0 and fields.get('failed', '0').split()[0]=='0') else  'failed'
+      job.wall_seconds=parse_duration(fields.get('ru_wallclock', '0'))
+      job.cpu_seconds=parse_duration(fields.get('cpu', '0'))
+      job.max_rss_gb=max(parse_size_gb(fields.get('maxrss', '0')), parse_size_gb(fields.get('maxvmem', '0')))
+      job.ncpus=max(1, int(fields.get('slots', '1')))
+      usage[(sched_id, task_id)]=job     # a job run again (e.g. rescheduled) is listed again: the last record is kept
+  return usage
+
+def percentile(values, q):
+  """ Returns the q-th percentile (0-100) of a non-empty list of numbers, by linear interpolation """
+  values=sorted(values)
+  position=(len(values)-1)*q/100
+  low=int(position)
+  high=min(low+1, len(values)-1)
+  return values[low] + (values[high]-values[low])*(position-low)
+
+def format_time_limit(seconds):
+  """ Returns a time limit in the format of qjob option -t, rounding up: minutes (e.g. 30m) below two hours, then hours """
+  minutes=max(1, math.ceil(seconds/60))
+  if minutes<120:
+    return f'{minutes}m'
+  return str(math.ceil(minutes/60))
+
+def recommend_resources(usages, headroom=1.2):
+  """ Returns the values of qjob options -m, -t and -p that would fit all the jobs provided (JobUsage instances), with some
+  headroom above the largest memory and time used: a dict with keys m (GB, int), t (str, as for option -t) and p (int).
+  -p is the number of processors used on average while running, in the 95th percentile of jobs """
+  max_rss=max([u.max_rss_gb for u in usages])
+  max_wall=max([u.wall_seconds for u in usages])
+  cores_used=[u.cpu_seconds/u.wall_seconds  for u in usages  if u.wall_seconds]
+  return {'m':max(1, math.ceil(max_rss*headroom)),
+          't':format_time_limit(max_wall*headroom),
+          'p':max(1, round(percentile(cores_used, 95)))  if cores_used else 1}
+
+def efficiency_scores(usages, requested_memory_gb=None, requested_minutes=None):
+  """ Returns a dict with the efficiency of a batch of jobs (JobUsage instances), from 0 to 1: cpu (cpu time used out of the
+  allocated one), and, if the requests are provided, memory (mean max RSS out of the memory requested) and time
+  (mean wall time out of the time limit). Key score is the mean of all available efficiencies """
+  scores={}
+  allocated=sum([u.wall_seconds*u.ncpus for u in usages])
+  if allocated:
+    scores['cpu']=min(1.0, sum([u.cpu_seconds for u in usages])/allocated)
+  if requested_memory_gb:
+    scores['memory']=min(1.0, sum([u.max_rss_gb for u in usages])/len(usages)/requested_memory_gb)
+  if requested_minutes:
+    scores['time']=min(1.0, sum([u.wall_seconds for u in usages])/len(usages)/(requested_minutes*60))
+  if scores:
+    scores['score']=sum(scores.values())/len(scores)
+  return scores
@@ -0,0 +1,138 @@
+__author__  = "Marco Mariotti"
+__email__   = "marco.mariotti@ub.edu"
+
+import os
+from more_itertools import chunked
+from .cli import def_opt, iter_direct_lines, split_in_jobs, unzip_jobs
+from .scripts import JobScript
+from .template import compile_template
+from .inputs import open_input
+from .submission import submit_jobs
+from .local import run_local_jobs
+
+#### Python API: the same job files as the qjob command line, without reading ~/.qjob or printing anything. Example:
+#   spec=JobSpec(['echo a', 'echo b'], name='test', sys='slurm', q='short', nlines=1)
+#   outfiles=write_jobs(spec, 'test.jbs')
+#   for result in Submitter('slurm').submit(outfiles):  print(result.job_id)
+
+class JobSpec(object):
+  """Specification of a workload: command lines, and the qjob options to split them in jobs and to write job files.
+
+  Parameters
+  ----------
+  commands : iterable of str
+      command lines; they are consumed lazily, unless option njobs is used
+  name : str
+      base name of jobs; job N is named {name}.N
+  **options
+      any qjob option, as named in the command line (see qjob -h full), e.g. sys='slurm', q='short', m=4, t='30m',
+      p=2, nlines=10, njobs=0, joe=True, track=True. Options not provided take qjob built-in defaults, not those in ~/.qjob
+  """
+  def __init__(self, commands, name='qjob', **options):
+    unknown=[k for k in options if not k in def_opt]
+    if unknown:
+      raise ValueError(f'JobSpec ERROR unknown option(s): {" ".join(unknown)}')
+    self.commands=commands
+    self.name=name
+    self.opt=dict(def_opt)
+    self.opt.update(options)
+
+  def __repr__(self):
+    return f'JobSpec(name={self.name}, sys={self.opt["sys"]}, nlines={self.opt["nlines"]}, njobs={self.opt["njobs"]})'
+
+  @classmethod
+  def from_file(cls, filename, name=None, **options):
+    """Returns a JobSpec with the command lines of a file, as in qjob direct mode (-i). The file is read lazily, and decompressed if compressed """
+    def commands():
+      with open_input(filename) as fh:
+        yield from iter_direct_lines(fh)
+    return cls(commands(), name=os.path.basename(filename) if name is None else name, **options)
+
+  @classmethod
+  def from_template(cls, template, rows, fields=None, name='qjob', **options):
+    """Returns a JobSpec whose command lines are produced by filling a template (with placeholders in {}) with rows of data,
+    as in qjob template mode (-c/-d). Rows are dicts, or lists ordered as fields if these are provided. Rendering is lazy """
+    def commands():
+      render=None if fields is None else compile_template(template, fields)
+      for row in rows:
+        yield template.format(**row)  if render is None else  render(row)
+    return cls(commands(), name=name, **options)
+
+
+class RenderedJob(object):
+  """ A job produced by render_jobs: its index (1-based), name, file path, script text and indices of its command lines """
+  def __init__(self, index, name, path, script, line_indices):
+    self.index=index
+    self.name=name
+    self.path=path
+    self.script=script
+    self.line_indices=line_indices
+
+  def __repr__(self):
+    return f'RenderedJob(index={self.index}, name={self.name}, path={self.path}, n_lines={len(self.line_indices)})'
+
+  def write(self):
+    """ Writes the job file; returns its path """
+    with open(self.path, 'w') as ofh:
+      ofh.write(self.script)
+    return self.path
+
+
+def render_jobs(spec, folder, dependency_ids=[]):
+  """Splits the command lines of a JobSpec in jobs (per options nlines or njobs) and yields a RenderedJob for each, lazily.
+  Nothing is written; job files and their logs would be placed in folder. Job scripts are the same as written by the
+  qjob command line; options only available there (e.g. pack, shard, cost, resume, arr) are not used here.
+  dependency_ids are scheduler IDs of jobs that must complete successfully first (as option -after) """
+  opt=spec.opt
+  script=JobScript(opt, dependency_ids=dependency_ids)
+  folder=os.path.abspath(folder)
+  cmd_lines=enumerate(spec.commands)   # tuples (line_index, command)
+  if opt['njobs']:
+    cmd_lines=list(cmd_lines)
+    jobs=unzip_jobs( split_in_jobs(iter(cmd_lines), len(cmd_lines), opt['njobs']) )  if cmd_lines else  iter([])
+  else:
+    jobs=unzip_jobs( chunked(cmd_lines, opt['nlines']) )
+  for job_index, (line_indices, job_commands) in enumerate(jobs, 1):
+    name=f'{spec.name}.{job_index}'
+    path=f'{folder}/{name}'
+    logout=f'{path}.{script.suffix_out}'
+    logerr=f'{path}.{script.suffix_err}'
+    yield RenderedJob(job_index, name, path,
+                      script.header(name, path, logout, logerr) + script.body(job_commands, line_indices, status_file=path+'.status'),
+                      line_indices)
+
+def write_jobs(spec, folder, dependency_ids=[]):
+  """Writes the job files of a JobSpec in folder (created if missing); returns the list of their paths """
+  os.makedirs(folder, exist_ok=True)
+  return [job.write() for job in render_jobs(spec, folder, dependency_ids=dependency_ids)]
+
+
+class Submitter(object):
+  """Submits job files to the queue (sge or slurm) as qjob -qsub does: concurrent qsub/sbatch calls, retried with
+  exponential backoff on temporary scheduler errors. With sys='local', job files are run on this computer instead.
+
+  Parameters
+  ----------
+  sys : str
+      sge, slurm or local
+  submit_options : str
+      options added to qsub/sbatch calls (as -so)
+  workers : int
+      concurrent submissions (as -sw), or jobs run at the same time with sys='local' (as -lj)
+  max_attempts : int
+      max qsub/sbatch calls per job file (as -sa)
+  """
+  def __init__(self, sys='sge', submit_options='', workers=8, max_attempts=5):
+    if not sys in ('sge', 'slurm', 'local'):
+      raise ValueError(f'Submitter ERROR sys must be one of sge, slurm, local; not: {sys}')
+    self.sys=sys
+    self.submit_options=submit_options
+    self.workers=workers
+    self.max_attempts=max_attempts
+
+  def submit(self, outfiles):
+    """Submits job files (or runs them, with sys='local'). Yields a SubmissionResult (or LocalTaskResult) for each, as they complete.
+    When a submission fails for a non-transient error, the files not yet submitted are not attempted """
+    if self.sys=='local':
+      return run_local_jobs(outfiles, workers=self.workers)
+    return submit_jobs(outfiles, self.sys, self.submit_options, workers=self.workers, max_attempts=self.max_attempts)
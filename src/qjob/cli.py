@@ -3,15 +3,30 @@ __author__  = "Marco Mariotti"
 __email__   = "marco.mariotti@ub.edu"
 
 from ._version import __version__
-import sys, os, subprocess, shlex, shutil, string
-from more_itertools import divide, chunked
-from easyterm import command_line_options, read_config_file, write, printerr, check_file_presence, NoTracebackError
+import sys, os, re, shlex, shutil, string, time, heapq, hashlib, glob, json, cProfile, signal
+from itertools import chain, islice
+from more_itertools import chunked
+from easyterm import command_line_options, read_config_file, write, printerr, service, check_file_presence, NoTracebackError
+from .submission import submit_jobs
+from .template import compile_template
+from .inputs import open_input, count_lines
+from .scripts import JobScript, index_width
+from .local import run_local_jobs, parse_range
+from .jobdb import JobDB, query_queue, db_filename
+from .uptodate import up_to_date_lines, read_hashes, write_hashes
+from .queues import query_queue_loads, QueueBalancer
+from .accounting import query_accounting, percentile, recommend_resources, efficiency_scores
+from .server import SubmissionServer, server_is_running, submit_via_server, default_socket_path
 
 
 #### default options:
 def_opt= {'i':'',           'c':'',        'd':'',
           'sys':'sge',
-          'arr':'',      
+          'arr':'',         'pack':False,
+          'index':False,
+          'cost':'',        'res':'',
+          'outputs':'',     'inputs':'',    'hash':False,
+          'qload':False,
           'n':'',           'o':'',
           'nlines':1,       'njobs':0,
           'q':'default_q',  'p':1,
@@ -19,47 +34,23 @@ def_opt= {'i':'',           'c':'',        'd':'',
           'setup':False,
           'head':'',        'foot':'',
           'e':False,        'so':'',
-          'f':False,
+          'f':False,        'clean':False,
+          'shard':0,
           'bin':'',         'so':'',
           'E':'a',          'email':'youremail@domain.com',
           'joe':False,      'sl':False,
           'qsyn':'S=queue1,queue2;L=queue3,queue2',
           'xset':'',        'x':'',
           'srun':False,     'qos':'',
-          'qsub':False,
+          'par':False,
+          'track':False,    'resume':False,
+          'qsub':False,     'sw':8,         'sa':5,
+          'lj':0,           'v':False,
+          'socket':'',
+          'timings':'',     'profile':'',
+          'after':'',       'aftercorr':False,
           'pe':'smp',       'peq':'queue_arg1=pe_type1;queue_arg2=pe_type2' }
 
-#### templates:
-sge_header_template="""#!/bin/bash
-#$ -S /bin/bash
-#$ -cwd
-#$ -M {email} {queue_line}{time_line}{additional_options}
-#$ -N {name}{mem}{cpus} 
-"""
-sge_header_single_job=sge_header_template+"""#$ -e {logerr}
-#$ -o {logout}
-"""
-sge_header_array_job=sge_header_template+"""#$ -e {logerr}
-#$ -o {logout}
-#$ -t {range_str}
-"""
-
-sge_pe_template=  "\n#$ -pe {pe} {procs}"   ## for n of processors
-slurm_pe_template="\n#SBATCH -c {procs}"   
-
-slurm_header_template="""#!/bin/bash       
-#SBATCH -J {name} {queue_line}{time_line}{additional_options}{mem}{cpus}
-#SBATCH --mail-user={email}
-"""
-
-slurm_header_single_job=slurm_header_template+"""#SBATCH -e {logerr}
-#SBATCH -o {logout}
-"""
-slurm_header_array_job= slurm_header_template+"""#SBATCH -e {logerr}
-#SBATCH -o {logout}
-#SBATCH -a {range_str}
-"""
-
 #### help messages
 
 help_msg="""qjob: split commands into jobs, then submit them to a queueing system
@@ -82,12 +73,41 @@ It splits command lines in "jobs", and prepare files for their submission to the
 -nlines | -nl   each submitted job will have X lines of commands (or X templates, in template mode)
 -njobs  | -nj   set this to have a number of jobs X. Overrides -nlines
 -qsub   | -Q    submit the jobs to the queue with qsub (SGE) or sbatch (Slurm)
+-track          each command line records its exit status in a .status file in the jobs folder
+-resume         re-run qjob with the same input and -resume to write (and submit, with -Q) new jobs only for the lines
+                that failed or never completed, according to .status files. Requires a previous run with -track.
+                Previous jobs must not be in the queue anymore. New jobs get names like JOBNAME.r1.N
+-cost           balance jobs by the expected cost (e.g. runtime) of each line, instead of their number.
+                In template mode, provide the name of a numerical column of the data table.
+                In direct mode, provide a keyword annotated at the end of each line, e.g. with
+                "-cost sec" lines must end with something like:   #qjob sec=120
+-outputs        in template mode, skip rows whose output files are up to date, as make does. Provide the column(s) of the data table
+                with output files, comma separated. A row is skipped if all its outputs exist and are newer than its inputs
+-inputs         column(s) of the data table with input files, for -outputs
+-hash           with -outputs, compare the content of input files with the one they had when the row was last written in a job
+                (hashes are stored in the jobs folder), instead of modification times
 
 ### Job properties:   (use argument 0 to not specify)
 -q   queue name(s), comma separated
 -m   GB of memory requested
 -t   time limit in hours. Add m for minutes, or d for days; e.g. -t 30m
 -p   number of processors requested (default: 1)
+-res take memory (m), time limit (t) and/or processors (p) of each line from the data table (template mode) or from annotations
+     of lines (direct mode, as for -cost), overriding -m, -t, -p. Provide option=column pairs, e.g. -res m=mem_gb,t=hours
+     Lines with the same resources are grouped into jobs requesting them (with -pack, one array job per group)
+-after  jobs folder(s) of a previous stage, comma separated: jobs start only after all its jobs completed successfully.
+        Requires that they were submitted with -qsub. Use "qjob workflow" to run a pipeline of stages at once
+-aftercorr  with -after and array jobs (-arr or -pack) in both stages: task N of this stage starts after task N
+            of the previous stage completed successfully. Both array jobs must have the same task IDs
+-par run the command lines of each job in parallel, using as many workers as processors (see -p).
+     The job fails (non-zero exit status) if any of its command lines fails
+
+## Other commands:
+qjob status jobs_folder.jbs    show the state of jobs (pending, running, finished...), with a single query to the queue
+qjob workflow stages.txt      submit a pipeline: one qjob command line per stage, each depending on the previous one
+qjob server                   run a server that submits job files for all qjob processes of yours (see qjob server -h)
+qjob feed   jobs_folder.jbs    submit the jobs of a folder written without -qsub, keeping at most a number of jobs in the queue
+qjob report jobs_folder.jbs    resources used by finished jobs (time, memory, cpu), with recommended -m, -t, -p
 
 ## Other options:
 -print_opt    prints default values for all options
@@ -98,9 +118,13 @@ It splits command lines in "jobs", and prepare files for their submission to the
 """
 
 long_help="""## Utilities:
--sys     cluster system; possible values: "sge" (default) or "slurm"
+-sys     cluster system; possible values: "sge" (default), "slurm" or "local".
+         With "local", jobs are run on this computer instead of being submitted (with -qsub); queue,
+         memory and time limit are ignored, and array tasks get $SGE_TASK_ID and $SLURM_ARRAY_TASK_ID
+-lj      with -sys local, number of jobs run at the same time (default: number of CPUs divided by -p)
 -o       output folder
--i       input file. Note: use "-" as argument to read standard input (if so you must provide -o)
+-i       input file. Note: use "-" as argument to read standard input (if so you must provide -o).
+         Input files (-i, -d) ending in .gz, .bz2, .xz or .zst are decompressed while reading
 -n       define base name of jobs (numerical suffixes will be added to each)
 -joe     join std output and error logs; so that every job produce a single output file
 -sl      use single log for all jobs, instead of 1 out, 1 err per job
@@ -112,10 +136,33 @@ long_help="""## Utilities:
 -arr     submit as array job. Provide an index range (e.g. 1-10) as argument 
          Requires a template input (-c) including taskid variables, e.g. $SGE_TASK_ID
          Data table (-d) may be used to expand the template but it is not required
--f       force overwrite of jobs folder if existing. By default, qjob prompts the user
+-pack    write all job files, then submit them with a single array job whose task N runs job N.
+         Use it to avoid one qsub/sbatch call per job when submitting many jobs.
+         Check your cluster's maximum array size (e.g. MaxArraySize in slurm) before using it
+-index   write a single array job whose task N runs the commands of job N, instead of one file per job. The commands of
+         all jobs are written to one file (.cmds), with a file of their byte offsets (.idx) from which each task reads
+         only its own, so the array job is small and task startup does not depend on the number of jobs. With the
+         default -nlines 1, task N runs the command line of input line N (or data table row N)
+-sw      number of submissions (qsub or sbatch calls) run concurrently
+-sa      max attempts for each submission; failures due to temporary scheduler problems are retried
+         with exponential backoff. IDs of submitted jobs are written to submitted_jobs.tsv in the output folder
+-socket  unix socket of the qjob server (see: qjob server -h); default: ~/.qjob.sock. When a server is running,
+         job files are submitted through it instead of by this process. Use -socket 0 to never use the server
+-v       verbose: list every job file written, submitted or run. By default, a progress counter is shown instead
+-timings write a report of the duration of each phase of qjob (reading input, writing files, submission...), the
+         number of lines and jobs, and the latency of qsub/sbatch calls, to the JSON file given as argument
+-profile profile qjob with cProfile, and save stats to the file given as argument (inspect it with: python -m pstats)
+-f       force update of jobs folder if existing. By default, qjob prompts the user
+-shard   place job files and their logs in subfolders of the jobs folder (jobs/000/, jobs/001/ ...), each with the
+         number of jobs given as argument. Recommended for many thousands of jobs. File manifest.tsv in the jobs folder
+         lists the path of each job file and its logs
+-clean   delete the jobs folder if existing, instead of updating it. When updating, only job files whose
+         content changed are rewritten, and log files of unchanged jobs are kept
 -xset    define configuration shortcuts: keywords which, when called with -x, set any number of options.
          Format example: -xset 's1:"-q short -t 10" s2:"-q long"' so that '-x s1' implies '-q short -t 10'
 -x       use a config shortcut (keyword as argument). Requires -xset (in ~/.qjob or on command line)
+-qload   with several queues in -q (or a synonym expanding to several), assign each job to the queue where it is expected
+         to wait less, from a snapshot of their load (free, used and pending processors). In SGE, -peq applies to each queue
 -qsyn    defining synonyms for -q, using format: "SYN_NAME=queue1;OTHER_SYN=queue2,queue3"
 -email   email provided when submitting job
 -E       send an email in conditions determined by the argument. Multiple may be concatenated, e.g. -E abe
@@ -136,19 +183,309 @@ long_help="""## Utilities:
 command_line_synonyms={'Q':'qsub', 'nj':'njobs', 'nl':'nlines', 'force':'f',
                        'tp':'pe'}
 
-def run_cmd(cmd):
-  """Utility function to run bash commands and show joined std.output/std.err if it fails """
-  p=subprocess.run(shlex.split(cmd),
-                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                   text=True)
-  if p.returncode!=0:
-    raise Exception(f'\nWhile running command= {cmd}\nThere was ERROR= {p.stdout}')
+annotation_marker='#qjob '
+# annotations are a trailing comment, preceded by whitespace, with only key=value words
+annotations_rx=re.compile(r'\s#qjob((?:\s+[^\s=]+=\S*)+)\s*$')
+
+def split_annotations(line):
+  """Splits a direct mode command line from its trailing annotations, written as:   command  #qjob key1=value1 key2=value2
+  Returns the command line and a dict of annotations """
+  match=annotations_rx.search(line)
+  if match is None:
+    return line, {}
+  annotations=dict( kv.split('=', 1)  for kv in match.group(1).split() )
+  return line[:match.start()].rstrip(), annotations
+
+def iter_direct_lines(fh, annotations=False, strip_annotations=False):
+  """Yields the command lines read from a file handle in direct mode, skipping empty lines and comments.
+  If strip_annotations is True (options -cost, -res), trailing annotations are removed from command lines;
+  if annotations is True, their dicts are yielded instead """
+  for line in fh:
+    s=line.strip()
+    if s and not s.startswith('#'):
+      if not (annotations or strip_annotations) or not annotation_marker in s:
+        yield {} if annotations else s
+        continue
+      cmd, line_annotations= split_annotations(s)
+      yield line_annotations if annotations else cmd
+
+def parse_cost(value, where):
+  """Returns the cost of a command line as float, checking it is valid; where is used in the error message """
+  try:
+    cost=float(value)
+    if cost<0: raise ValueError
+  except (TypeError, ValueError):
+    raise NoTracebackError(f'qjob ERROR invalid or missing cost in {where}: {value}') from None
+  return cost
+
+resource_options=('m', 't', 'p')
+
+def parse_resources(res):
+  """Parses the argument of option -res, e.g. m=mem_gb,t=hours. Returns a dict of qjob options (m, t, p) -> column name """
+  res_columns={}
+  for piece in res.split(','):
+    option, _, column=piece.partition('=')
+    if not option.strip() in resource_options or not column.strip():
+      raise NoTracebackError(f'qjob ERROR option -res must be a comma separated list of option=column, with options among '
+                             f'{", ".join(resource_options)} (e.g. -res m=mem_gb,t=hours); instead it was: {res}')
+    res_columns[option.strip()]=column.strip()
+  return res_columns
+
+def parse_resource_signature(values, opt, where):
+  """Returns the resources requested by a command line, as a tuple of values of options m, t, p (see resource_options).
+  values is a dict of option -> value; options missing or empty in values take their value in opt.
+  where is used in the error message """
+  signature=[]
+  for option in resource_options:
+    value=values.get(option, '')
+    value=value.strip()  if isinstance(value, str) else value
+    if value=='' or value is None:
+      signature.append(opt[option])
+      continue
+    try:
+      if option=='m':
+        value=float(value)
+        if value==int(value): value=int(value)   # 4, not 4.0, in job headers
+      elif option=='p':
+        value=int(value)
+      elif option=='t':
+        int(value[:-1] if value[-1] in 'mhd' else value)   # checking format, as in -t
+      if option!='t' and value<0: raise ValueError
+    except (TypeError, ValueError, IndexError):
+      raise NoTracebackError(f'qjob ERROR invalid value for -{option} in {where}: {value}') from None
+    signature.append(value)
+  return tuple(signature)
+
+def unzip_jobs(jobs):
+  """Takes an iterator of jobs, each a list of tuples (line_index, command), and yields tuples (line_indices, job_commands) """
+  for job in jobs:
+    yield [line_index for line_index, _ in job], [cmd for _, cmd in job]
+
+manifest_filename='manifest.tsv'
+
+manifest_columns=['file', 'sha1', 'job_index', 'log_out', 'log_err']
+
+def read_manifest(folder):
+  """Reads the manifest of job files in a jobs folder. Returns a dict of file paths (relative to folder) -> list of values
+  for the other manifest_columns: content hash, job index (empty for array files), output and error log paths """
+  manifest={}
+  path=os.path.join(folder, manifest_filename)
+  if os.path.isfile(path):
+    with open(path) as fh:
+      fh.readline()   # header
+      for line in fh:
+        s=line.rstrip('\n').split('\t')
+        manifest[s[0]]=s[1:] + ['']*(len(manifest_columns)-len(s))
+  return manifest
+
+def write_manifest(folder, manifest):
+  """Writes the manifest of job files in a jobs folder, given a dict like the one returned by read_manifest """
+  path=os.path.join(folder, manifest_filename)
+  with open(path+'.tmp', 'w') as ofh:
+    ofh.write('\t'.join(manifest_columns)+'\n')
+    for manifest_key, values in manifest.items():
+      ofh.write('\t'.join([manifest_key]+[str(v) for v in values])+'\n')
+  os.replace(path+'.tmp', path)
+
+def remove_job_files(outfile, array=False, keep_job_file=False):
+  """Removes a job file and its .LOG, .ERR and .status files, if present (and its .cmds and .idx files, unless keep_job_file is True).
+  If array is True, also task log files (outfile.N.LOG) """
+  paths=[outfile+'.LOG', outfile+'.ERR', outfile+'.status']
+  if not keep_job_file:
+    paths.extend([outfile, outfile+'.cmds', outfile+'.idx'])   # the last two with -index
+  if array:
+    paths.extend( glob.glob(glob.escape(outfile)+'.*.LOG') + glob.glob(glob.escape(outfile)+'.*.ERR') )
+  for path in paths:
+    try:
+      os.remove(path)
+    except FileNotFoundError:
+      pass
+
+def read_status_files(folder):
+  """Reads the exit status of command lines recorded in the .status files of a jobs folder (see option -track).
+  Job files are taken from the manifest, so that the folder is not listed.
+  Returns the set of indices of lines completed successfully, and the set of those which failed and never succeeded """
+  done, failed=set(), set()
+  for manifest_key in read_manifest(folder):
+    try:
+      with open(os.path.join(folder, manifest_key)+'.status') as fh:
+        for line in fh:
+          s=line.split()
+          if len(s)==2:
+            (done if s[1]=='0' else failed).add( int(s[0]) )
+    except FileNotFoundError:
+      continue
+  return done, failed-done
+
+def pack_by_cost(costs, n_jobs):
+  """Assigns command lines to n_jobs jobs (or less, if there are fewer lines) so that the maximum total cost per job is minimised,
+  using the greedy Longest Processing Time rule: lines by decreasing cost go to the least loaded job.
+  Ties are broken by line and job order, so the result is deterministic. Within each job, lines keep the input order.
+  Returns the list of jobs (each a list of line indices) and the list of their total costs """
+  n_jobs=min(n_jobs, len(costs))
+  heap=[(0.0, job_index) for job_index in range(n_jobs)]
+  assignment=[None]*len(costs)
+  for line_index in sorted(range(len(costs)), key=lambda i: (-costs[i], i)):
+    load, job_index=heapq.heappop(heap)
+    assignment[line_index]=job_index
+    heapq.heappush(heap, (load+costs[line_index], job_index))
+  jobs=[ [] for _ in range(n_jobs) ]
+  loads=[0.0]*n_jobs
+  for line_index, job_index in enumerate(assignment):
+    jobs[job_index].append(line_index)
+    loads[job_index]+=costs[line_index]
+  return jobs, loads
+
+class Progress(object):
+  """Counter of processed items (e.g. job files written) shown on a single line of the terminal, refreshed at most
+  every interval seconds, so that large workloads are not slowed down by console output.
+  Nothing is shown if the output is not a terminal. With verbose=True, the message of each item is printed instead """
+  def __init__(self, label, total=None, verbose=False, interval=0.2):
+    self.label=label
+    self.total=total
+    self.verbose=verbose
+    self.interval=interval
+    self.n=0
+    self.start=self.last_shown=time.perf_counter()
+
+  def update(self, msg=''):
+    """Counts one more item; msg is printed only in verbose mode """
+    self.n+=1
+    if self.verbose:
+      write(msg)
+      return
+    now=time.perf_counter()
+    if now-self.last_shown>=self.interval:
+      self.last_shown=now
+      total_str=f'/{self.total}' if self.total else ''
+      service(f'{self.label}: {self.n}{total_str}  ({now-self.start:.0f} s)')
+
+class PhaseTimer(object):
+  """Records the duration of the consecutive phases of a qjob run, for option -timings """
+  def __init__(self):
+    self.phases={}     # phase name -> seconds
+    self.start=self.last=time.perf_counter()
+
+  def lap(self, phase):
+    """Ends the current phase, which is recorded with the name provided; the next phase starts now """
+    now=time.perf_counter()
+    self.phases[phase]=self.phases.get(phase, 0.0) + now-self.last
+    self.last=now
+
+def latency_summary(latencies):
+  """Returns a dict with the number, median, 95th percentile, max and sum of a list of durations in seconds """
+  if not latencies:
+    return {'n':0}
+  return {'n':len(latencies), 'p50_s':round(percentile(latencies, 50), 4), 'p95_s':round(percentile(latencies, 95), 4),
+          'max_s':round(max(latencies), 4), 'total_s':round(sum(latencies), 3)}
+
+def split_in_jobs(cmd_lines, tot_lines, n_jobs):
+  """Splits an iterator of tot_lines command lines into n_jobs lists (or less, if there are fewer lines), yielded one by one.
+  Lists have the same sizes as in more_itertools.divide, but lines are consumed lazily instead of being stored all in memory.
+  Raises NoTracebackError if the iterator does not yield exactly tot_lines lines """
+  n_jobs=min(n_jobs, tot_lines)
+  q, r=divmod(tot_lines, n_jobs) if n_jobs>0 else (0, 0)
+  mismatch_msg=(f'qjob ERROR {tot_lines} command lines were counted in the input, but a different number was read while '
+                f'writing jobs. Was the input modified in the meantime?')
+  for job_index in range(n_jobs):
+    job_size=q+1 if job_index<r else q
+    job=list(islice(cmd_lines, job_size))
+    if len(job)<job_size:
+      raise NoTracebackError(mismatch_msg)
+    yield job
+  if not next(cmd_lines, None) is None:
+    raise NoTracebackError(mismatch_msg)
+
+def stage_job_ids(folder):
+  """Returns the scheduler IDs of the jobs of a jobs folder (with or without .jbs suffix) which may still be in the queue,
+  as recorded in its job-state database; used for dependencies between stages (-after) """
+  folder=folder.rstrip('/')
+  if not os.path.isfile(os.path.join(folder, db_filename)) and os.path.isfile(os.path.join(folder+'.jbs', db_filename)):
+    folder+='.jbs'
+  if not os.path.isfile(os.path.join(folder, db_filename)):
+    raise NoTracebackError(f'qjob ERROR option -after: jobs folder not found: {folder}')
+  jobdb=JobDB(folder)
+  sched_ids=sorted(jobdb.sched_ids(), key=lambda x:(len(x), x))
+  n_written=sum([count for state, count in jobdb.state_counts() if state=='written'])
+  jobdb.close()
+  if n_written:
+    raise NoTracebackError(f'qjob ERROR option -after: {n_written} job(s) in {folder}/ were not submitted; use -qsub in previous stages')
+  if not sched_ids:
+    printerr(f'qjob WARNING option -after: jobs in {folder}/ are not in the queue anymore; no dependency is set on them')
+  return sched_ids
+
+def submit_all(outfiles, opt, output_folder, jobdb, all_results=None):
+  """Submits job files concurrently, records their job IDs in the job-state database and in submitted_jobs.tsv in output_folder,
+  and prints a summary. If a list all_results is provided, SubmissionResult instances are appended to it.
+  Raises NoTracebackError if any submission failed """
+  socket_path=opt['socket'] if opt['socket'] else default_socket_path
+  if opt['socket']!='0' and server_is_running(socket_path):
+    write(f'\nSubmitting {len(outfiles)} job file(s) through the qjob server on {socket_path}')
+    submission_results=submit_via_server(outfiles, opt['sys'], opt['so'], socket_path=socket_path)
+  else:
+    write(f'\nSubmitting {len(outfiles)} job file(s) with {opt["sw"]} concurrent workers')
+    submission_results=submit_jobs(outfiles, opt['sys'], opt['so'], workers=opt['sw'], max_attempts=opt['sa'])
+  start=time.perf_counter()
+  results={}
+  progress=Progress('Submitted', total=len(outfiles), verbose=opt['v'])
+  for result in submission_results:
+    results[result.outfile]=result
+    if not all_results is None:
+      all_results.append(result)
+    if not result.job_id is None:
+      progress.update(f'Submitted job {result.job_id} : {result.outfile}')
+  elapsed=time.perf_counter()-start
+
+  jobdb.record_submissions( [(r.outfile, r.job_id) for r in results.values()  if not r.job_id is None] )
+  with open(f'{output_folder}/submitted_jobs.tsv', 'w') as ofh:
+    for outfile in outfiles:
+      if not results[outfile].job_id is None:
+        ofh.write(f'{outfile}\t{results[outfile].job_id}\n')
+
+  failed=[results[outfile] for outfile in outfiles  if results[outfile].job_id is None]
+  n_retries=sum([max(0, r.attempts-1) for r in results.values()])
+  write(f'Submission summary: {len(outfiles)-len(failed)} submitted, {len(failed)} not submitted, '
+        f'{n_retries} retries, {elapsed:.1f} seconds')
+  if failed:
+    attempted=[r for r in failed if r.attempts]
+    for r in attempted:
+      printerr(f'qjob ERROR submitting {r.outfile} after {r.attempts} attempt(s):\n{r.error}')
+    raise NoTracebackError(f'qjob ERROR {len(failed)} job file(s) were not submitted '
+                           f'({len(attempted)} failed, {len(failed)-len(attempted)} not attempted). '
+                           f'Submitted jobs are listed in {output_folder}/submitted_jobs.tsv')
+
+def run_all_locally(outfiles, opt, jobdb):
+  """Runs job files on the local machine (-sys local), records their exit status in the job-state database, and prints a summary.
+  Raises NoTracebackError if any job failed """
+  workers=opt['lj'] if opt['lj'] else max(1, (os.cpu_count() or 1) // max(1, opt['p']))
+  write(f'\nRunning {len(outfiles)} job file(s) locally, {workers} at a time')
+  start=time.perf_counter()
+  failed=[]
+  results=[]
+  progress=Progress('Finished', verbose=opt['v'])
+  for result in run_local_jobs(outfiles, workers=workers):
+    results.append(result)
+    task_str='' if result.task_id is None else f' task {result.task_id}'
+    progress.update(f'Finished{task_str} with exit status {result.exit_status} : {result.outfile}')
+    if result.exit_status!=0:
+      failed.append(result)
+  jobdb.record_exit_status( [(r.outfile, r.task_id, r.exit_status) for r in results] )
+  write(f'Local run summary: {len(results)-len(failed)} succeeded, {len(failed)} failed, {time.perf_counter()-start:.1f} seconds')
+  if failed:
+    raise NoTracebackError(f'qjob ERROR {len(failed)} local job(s) failed; check their log files')
 
 #########################################################
 ###### start main program function
 
-def main(args={}):
-  """Main function of the program, run when this is executed from the command line """
+def main(args={}, arglist=None):
+  """Main function of the program, run when this is executed from the command line.
+  Options are read from the command line, or from arglist if provided (e.g. ['-i', 'file.sh', '-Q']), or are
+  provided as a complete dict in args. Returns None, so that the exit status is 0 when used as entry point """
+  run(args=args, arglist=arglist)
+
+def run(args={}, arglist=None):
+  """Runs qjob as main does, with the same arguments, and returns the jobs folder (None for subcommands) """
+  timer=PhaseTimer()
 
   # printing program startup header  
   qjob_head='<<<{:^16}>>>'.format( f'qjob v{__version__}' )
@@ -156,6 +493,10 @@ def main(args={}):
   write('|------------->>>   ', end='')
   write(qjob_head, how='reverse', end='')
   write('   <<<-------------|\n')  
+
+  ## subcommands, e.g.:  qjob status jobs_folder.jbs
+  if not args and arglist is None and len(sys.argv)>1 and sys.argv[1] in subcommands:
+    return subcommands[sys.argv[1]]( sys.argv[2:] )
   
   ## loading options  
   if not args:
@@ -163,7 +504,7 @@ def main(args={}):
 
     ################### -setup
     # first run: writing ~/.qjob file
-    if '-setup' in sys.argv:
+    if '-setup' in (sys.argv if arglist is None else arglist):
       if os.path.isfile(user_config_file):
         raise NoTracebackError(f'qjob ERROR -setup was given but file {user_config_file} exists!\n'
                                f'If you really want to restore built-in defaults, delete the file and run again: qjob -setup')      
@@ -193,10 +534,11 @@ def main(args={}):
       raise NoTracebackError(f'qjob ERROR the file {user_config_file} is not found.\nFirst time user? Then run qjob -setup')
     else:
       conf_opt = read_config_file(user_config_file, types_from=def_opt)
-      def_opt.update(conf_opt)
-      opt=command_line_options(def_opt, help_msg,  'i',
+      user_def_opt=dict(def_opt)
+      user_def_opt.update(conf_opt)
+      opt=command_line_options(user_def_opt, help_msg,  'i',
                                synonyms=command_line_synonyms,
-                               advanced_help_msg={'full':long_help} )
+                               advanced_help_msg={'full':long_help}, arglist=arglist )
   else:
     opt=args
 
@@ -237,12 +579,41 @@ def main(args={}):
     ## what if some of the options in shortcut were overriden by command line? Taking care here:
     opt=command_line_options(opt, help_msg,  'i',
                              synonyms=command_line_synonyms,
-                             advanced_help_msg={'full':long_help} )
+                             advanced_help_msg={'full':long_help}, arglist=arglist )
   ### end of shortcuts
+  timer.lap('options')
+
+  ## performance reports: -profile and -timings
+  profiler=None
+  if opt['profile']:
+    profiler=cProfile.Profile()
+    profiler.enable()
+  run_counts={}          # numbers of lines, jobs... for -timings
+  submission_results=[]
+  def save_performance_reports():
+    """ Writes the -timings report and the -profile stats, if requested """
+    if not profiler is None:
+      profiler.disable()
+      profiler.dump_stats(opt['profile'])
+      write(f'Profile stats written to {opt["profile"]}')
+    if opt['timings']:
+      report={'qjob_version':__version__,
+              'total_s':round(time.perf_counter()-timer.start, 3),
+              'phases':{phase:round(seconds, 4) for phase, seconds in timer.phases.items()},
+              'counts':run_counts,
+              'scheduler_calls':latency_summary([t  for r in submission_results  for t in r.latencies])}
+      if 'generation' in timer.phases:
+        file_writing=timer.phases.get('file_writing', 0.0)
+        report['generation_breakdown']={'file_writing':round(file_writing, 4),
+                                         'reading_rendering_splitting':round(timer.phases['generation']-file_writing, 4)}
+        del report['phases']['file_writing']
+      with open(opt['timings'], 'w') as fh:
+        json.dump(report, fh, indent=1)
+      write(f'Timings written to {opt["timings"]}')
 
   ## checking input options      
-  if not opt['sys'] in ['sge', 'slurm']:
-    raise NoTracebackError('qjob ERROR -sys  must be one of  sge, slurm')
+  if not opt['sys'] in ['sge', 'slurm', 'local']:
+    raise NoTracebackError('qjob ERROR -sys  must be one of  sge, slurm, local')
   
   if (  not opt['i'] and
        not ( (opt['arr'] and opt['c']) or     # array mode not active
@@ -254,6 +625,22 @@ def main(args={}):
                             'or 3) options -arr start-end      and  -c template_cmd.sh  [array mode]\n\n'
                             'Run qjob -h for more info'))
 
+  if opt['pack'] and opt['arr']:
+    raise NoTracebackError('qjob ERROR options -pack and -arr are incompatible')
+  if opt['index'] and (opt['arr'] or opt['pack'] or opt['par']):
+    raise NoTracebackError('qjob ERROR option -index is incompatible with -arr, -pack and -par')
+  if opt['res'] and (opt['arr'] or opt['index'] or opt['cost'] or opt['njobs']):
+    raise NoTracebackError('qjob ERROR option -res is incompatible with -arr, -index, -cost and -njobs')
+  res_columns=parse_resources(opt['res']) if opt['res'] else {}
+  if (opt['outputs'] or opt['inputs'] or opt['hash']) and not opt['d']:
+    raise NoTracebackError('qjob ERROR options -outputs, -inputs and -hash require template mode (-c and -d)')
+  if (opt['inputs'] or opt['hash']) and not opt['outputs']:
+    raise NoTracebackError('qjob ERROR options -inputs and -hash require -outputs')
+  if opt['cost'] and opt['arr']:
+    raise NoTracebackError('qjob ERROR options -cost and -arr are incompatible')
+  if (opt['track'] or opt['resume']) and opt['arr']:
+    raise NoTracebackError('qjob ERROR options -track and -resume are incompatible with -arr')
+
   # checking -arr is in the right format, if specified
   if opt['arr']:
     try:
@@ -264,34 +651,51 @@ def main(args={}):
       raise NoTracebackError(f'qjob ERROR option -arr must contain a valid array range specification, such as 1-100') from None
   
   ## reading input command lines
+  # command lines are produced by generators, so that they are streamed into job files without keeping them all in memory
   if opt['i']:
     # direct input mode
+    strip_annotations=bool(opt['cost'] or opt['res'])   # otherwise, lines are kept as they are
     if opt['i']=='-':
       write('Input: stdin')
       if not opt['o']:
         raise NoTracebackError("qjob ERROR you must specify job name with -o if reading from standard input!")
-      input_commands=[line.strip() for line in sys.stdin]
+      if opt['njobs'] or opt['cost'] or opt['res']:  # stdin can be read only once, but we need to read it twice
+        stdin_lines=list(sys.stdin)
+        cmd_lines_iterator=lambda : iter_direct_lines(stdin_lines, strip_annotations=strip_annotations)
+        count_cmd_lines=lambda : sum(1 for _ in iter_direct_lines(stdin_lines))
+        line_annotations_iterator=lambda : iter_direct_lines(stdin_lines, annotations=True)
+      else:
+        cmd_lines_iterator=lambda : iter_direct_lines(sys.stdin, strip_annotations=strip_annotations)
     else:
       write(f'Input: file {opt["i"]}')      
       check_file_presence(opt['i'], 'inputfile (option -i)')
-      cmd_lines=[]
-      with open(opt['i']) as tfh:
-        for line in tfh:
-          s=line.strip()
-          if s and not s.startswith('#'):
-            cmd_lines.append(s)
+      def cmd_lines_iterator():
+        with open_input(opt['i']) as tfh:
+          yield from iter_direct_lines(tfh, strip_annotations=strip_annotations)
+      count_cmd_lines=lambda : count_lines(opt['i'], skip_comments=True)
+      def line_annotations_iterator():
+        with open_input(opt['i']) as tfh:
+          yield from iter_direct_lines(tfh, annotations=True)
+
+    def line_costs_iterator():
+      for line_index, annotations in enumerate(line_annotations_iterator()):
+        yield parse_cost(annotations.get(opt['cost']), f'annotation "{opt["cost"]}" of command line n.{line_index}')
+
+    def line_resources_iterator():
+      for line_index, annotations in enumerate(line_annotations_iterator()):
+        yield parse_resource_signature({option:annotations.get(key, '')  for option, key in res_columns.items()}, opt,
+                                       f'annotations of command line n.{line_index}')
             
   else:
     # template input mode
     write(f'Input: template file {opt["c"]}')          
     check_file_presence(opt['c'], 'template command file (option -c)')
     template_line='\n'.join( [line.strip() for line in open(opt['c'])] )
-    cmd_lines=[]
     if opt['d']:
       write(f'Input: data table {opt["d"]}')                
       check_file_presence(opt['d'], 'data file to fill template (option -d)')            
-      fh=open(opt['d'])
-      fields=fh.readline().strip().split('\t')
+      with open_input(opt['d']) as fh:
+        fields=fh.readline().strip().split('\t')
 
       # checking that all requested keys are in the table      
       formatter=string.Formatter()
@@ -299,46 +703,99 @@ def main(args={}):
       if len(missing_req_keys):
         raise NoTracebackError(f"qjob ERROR parsing template -c {opt['c']} and data file -d {opt['d']}, "
                                f"template requires field(s) missing from data file: {' '.join(missing_req_keys)}")
+      if opt['cost'] and not opt['cost'] in fields:
+        raise NoTracebackError(f"qjob ERROR cost column -cost {opt['cost']} is missing from data file -d {opt['d']}")
+      missing_res_columns=[column for column in res_columns.values() if not column in fields]
+      output_columns=[column for column in opt['outputs'].split(',') if column]
+      input_columns= [column for column in opt['inputs'].split(',')  if column]
+      missing_file_columns=[column for column in output_columns+input_columns if not column in fields]
+      if missing_file_columns:
+        raise NoTracebackError(f"qjob ERROR column(s) of -outputs or -inputs missing from data file -d {opt['d']}: {' '.join(missing_file_columns)}")
+      if missing_res_columns:
+        raise NoTracebackError(f"qjob ERROR resource column(s) of -res missing from data file -d {opt['d']}: {' '.join(missing_res_columns)}")
       
-      for line_index, line in enumerate(fh):
-        if not line.strip():
-          continue
-        s=line[:-1].split('\t')
-        if len(s)!=len(fields):
-          raise NoTracebackError(f"qjob ERROR parsing data file -d {opt['d']}: line n.{line_index} has {len(s)} fields while header has {len(fields)}. Here's the line:\n{line[:-1]}")
-        datarow={ f:s[fi]  for fi, f in enumerate(fields)}
-        
-        try: 
-          this_command_line=template_line.format( **datarow )
-        except Exception as err:
-          printerr(f"qjob ERROR parsing data file -d {opt['d']} in line n.{line_index} when filling template with data:")
-          raise err from None
-        cmd_lines.append(this_command_line)
+      render_template=compile_template(template_line, fields)   # parsing template only once
+      def cmd_lines_iterator():
+        with open_input(opt['d']) as fh:
+          fh.readline()  # header
+          for line_index, line in enumerate(fh):
+            if not line.strip():
+              continue
+            s=line.rstrip('\n').split('\t')
+            if len(s)!=len(fields):
+              raise NoTracebackError(f"qjob ERROR parsing data file -d {opt['d']}: line n.{line_index} has {len(s)} fields while header has {len(fields)}. Here's the line:\n{line.rstrip()}")
+            try: 
+              this_command_line=render_template(s)
+            except Exception as err:
+              printerr(f"qjob ERROR parsing data file -d {opt['d']} in line n.{line_index} when filling template with data:")
+              raise err from None
+            yield this_command_line
+
+      count_cmd_lines=lambda : count_lines(opt['d'], skip_header=True)
+
+      def line_costs_iterator():
+        cost_index=fields.index(opt['cost'])
+        with open_input(opt['d']) as fh:
+          fh.readline()  # header
+          for line_index, line in enumerate(fh):
+            if not line.strip():
+              continue
+            yield parse_cost(line.rstrip('\n').split('\t')[cost_index], f"column {opt['cost']} of data file -d {opt['d']}, line n.{line_index}")
+
+      def line_files_iterator():
+        """ Yields tuples (line_index, output files, input files) for option -outputs; empty cells are ignored """
+        output_indices=[fields.index(column) for column in output_columns]
+        input_indices= [fields.index(column) for column in input_columns]
+        with open_input(opt['d']) as fh:
+          fh.readline()  # header
+          row_index=0    # index of command line, as in cmd_lines
+          for line in fh:
+            if not line.strip():
+              continue
+            s=line.rstrip('\n').split('\t')
+            if len(s)==len(fields):  # otherwise, the error is raised when reading command lines
+              yield (row_index, [s[i] for i in output_indices if s[i]], [s[i] for i in input_indices if s[i]])
+            row_index+=1
+
+      def line_resources_iterator():
+        res_indices={option:fields.index(column)  for option, column in res_columns.items()}
+        with open_input(opt['d']) as fh:
+          fh.readline()  # header
+          for line_index, line in enumerate(fh):
+            if not line.strip():
+              continue
+            s=line.rstrip('\n').split('\t')
+            yield parse_resource_signature({option:s[i]  for option, i in res_indices.items()}, opt,
+                                           f"resource columns of data file -d {opt['d']}, line n.{line_index}")
         
-    elif opt['arr']: #array mode with data table
-      cmd_lines=[template_line]
+    elif opt['arr']: #array mode without data table
+      cmd_lines_iterator=lambda : iter([template_line])
         
-  ####  now cmd_lines is defined; each one can be executed independently of others
-  # # debug
-  # for i, cl in enumerate(cmd_lines):
-  #   write(cl, how=['green', 'yellow'][i%2])
-
-  ## reading custom synonyms
-  queue_synonyms={}
-  if opt['qsyn']:
-    for assign_piece in opt['qsyn'].split(';'):
-      syn_name, queue =assign_piece.split('=') #queue can be comma separated but we pass it as it is
-      queue_synonyms[syn_name]=queue
-  pe_table={}
-  if opt['peq']:
-    for assign_piece in opt['peq'].split(';'):
-      queue, pe =assign_piece.split('=') 
-      pe_table[queue]=pe
+  ####  now cmd_lines_iterator is defined; calling it gives an iterator of command lines, each one can be executed independently of others
+
+  def validate_input():
+    """ Reads all command lines once, and their costs and resources with -cost and -res, to raise any error found in the input.
+    Only rows of data tables and annotations can be malformed: other lines are not read """
+    if opt['d']:
+      for _ in cmd_lines_iterator(): pass
+    if opt['cost']:
+      for _ in line_costs_iterator(): pass
+    if opt['res']:
+      for _ in line_resources_iterator(): pass
+
+  ## dependencies on jobs of previous stages
+  dependency_ids=[]
+  if opt['after'] and opt['after']!='0':
+    if opt['sys']=='local':
+      raise NoTracebackError('qjob ERROR option -after is not available with -sys local')
+    if opt['aftercorr'] and not (opt['arr'] or opt['pack'] or opt['index']):
+      raise NoTracebackError('qjob ERROR option -aftercorr requires an array job: use -arr, -pack or -index')
+    for stage_folder in opt['after'].split(','):
+      dependency_ids.extend( stage_job_ids(stage_folder) )
+    if opt['aftercorr'] and len(dependency_ids)>1:
+      raise NoTracebackError(f'qjob ERROR option -aftercorr requires that the previous stage is a single array job (-arr, -pack or -index); '
+                             f'instead, {len(dependency_ids)} jobs were found in: {opt["after"]}')
 
-  ###  determining number of jobs, number of lines
-  tot_lines=len(cmd_lines)
-  if tot_lines==0:    raise NoTracebackError("qjob ERROR the list of command lines is empty!")
-    
   ### Deriving output folder
   if not opt['o']:
     if opt['i']:
@@ -354,207 +811,630 @@ def main(args={}):
   else:
     prefix_name=os.path.basename( output_folder[:-4] )
 
-  ### output folder (and rewrite)
+  ### resume mode: reading which lines were completed in previous runs
+  resume_round=0
+  done_lines=set()
+  if opt['resume']:
+    if not os.path.isfile(os.path.join(output_folder, db_filename)):
+      raise NoTracebackError(f'qjob ERROR -resume was given, but the jobs folder {output_folder}/ from a previous run was not found')
+    done_lines, failed_lines=read_status_files(output_folder)
+    jobdb=JobDB(output_folder)
+    resume_round=int( jobdb.get_info('round', 0) ) + 1
+    jobdb.close()
+    prefix_name=f'{prefix_name}.r{resume_round}'    # new jobs get names distinct from those of previous runs
+    write(f'Resume: {len(done_lines)} command line(s) completed successfully in previous runs, {len(failed_lines)} failed. '
+          f'Writing jobs {prefix_name}.* for the failed or unfinished ones')
+
+  ### make-style skipping (-outputs): rows whose output files are up to date are treated as completed
+  hashes=None      # with -hash: dict of input hashes of rows, see uptodate.read_hashes
+  if opt['outputs']:
+    hashes=read_hashes(output_folder) if opt['hash'] else None
+    up_to_date=up_to_date_lines(line_files_iterator(), hashes=hashes)
+    done_lines=done_lines | up_to_date
+    write(f'Up to date: {len(up_to_date)} row(s) whose output files are up to date are skipped')
+    timer.lap('up_to_date')
+
+  ###  determining number of jobs, number of lines
+  cmd_lines=enumerate(cmd_lines_iterator())   # tuples (line_index, command)
+  if done_lines:
+    cmd_lines=( (line_index, cmd)  for line_index, cmd in cmd_lines  if not line_index in done_lines )
+  first_line=next(cmd_lines, None)
+  if first_line is None and (opt['resume'] or opt['outputs']):
+    write('\nqjob: all command lines were completed successfully or are up to date, there is nothing to run')
+    timer.lap('input')
+    save_performance_reports()
+    return output_folder
+  if first_line is None:    raise NoTracebackError("qjob ERROR the list of command lines is empty!")
+  cmd_lines=chain([first_line], cmd_lines)
+  if opt['njobs'] and not opt['arr'] and not opt['cost']:
+    tot_lines=count_cmd_lines()   # cheap first pass, only counting
+    tot_lines-=len( [i for i in done_lines if i<tot_lines] )
   if os.path.isdir(output_folder):
+    validate_input()   # so that errors in the input are raised before modifying the existing jobs folder
+  timer.lap('input')
+    
+  ### output folder (and rewrite)
+  previous_manifest=None   # when updating a jobs folder: dict of job files of the previous run -> their content hash
+  if opt['resume']:
+    previous_manifest=read_manifest(output_folder)   # keeping jobs, logs and status files of previous runs
+  elif os.path.isdir(output_folder) and opt['clean']:
     if not opt['f']:
       if not ( input(f'Jobs folder {output_folder}/ existing from a previous run; overwrite?\n'
                    f'This will delete previous log files, if present.\nReply= [Y] ') 
                    in ['', 'Y', 'y', 'yes'] ):
         raise NoTracebackError("Aborted. ")
     shutil.rmtree(output_folder)
-  os.mkdir(output_folder)
-
-  ### header/footer commands
-  init_command=''
-  if opt['bin']:
-    init_command += 'export PATH='+opt['bin']+':$PATH\n'
-  if opt['head']:
-    init_command += '\n'.join([ line.strip() for line in open(opt['head']) ])  # adding header lines
-  footer_command=''  if not opt['foot'] else (
-    '\n'.join([ line.strip() for line in open(opt['foot']) ]) + '\n' )  # adding footer lines
-
-  ## determining queue
-  queue_name=opt['q'] if not opt['q'] in queue_synonyms else queue_synonyms[opt['q']]
-
-  ## time limit
-  time_limit_minutes=None
-  if opt['t'] and opt['t']!='0':  
-    if   str(opt['t']).endswith('m'):       time_limit_minutes=int(opt['t'][:-1])  
-    elif str(opt['t']).endswith('d'):       time_limit_minutes=int(opt['t'][:-1])*60*24
-    elif str(opt['t']).endswith('h'):       time_limit_minutes=int(opt['t'][:-1])*60
-    else:                                   time_limit_minutes=int(opt['t'])*60
-
-  ## remaining lines to be put in job
-  additional_options=''
-  if   opt['sys']=='sge':
-    ## queue or partition
-    queue_line= "\n#$ -q {}".format(queue_name) if (queue_name and queue_name!='0') else ''
-    ## time constraint
-    time_line='\n#$ -l h_rt={h}:{m}:00'.format(h=time_limit_minutes//60, m=time_limit_minutes%60)  if not time_limit_minutes is None else ''
-    ## email
-    if opt['E']:          additional_options+='\n#$ -m {} '.format(opt['E']  if not opt['E']=='v' else 'abes')
-    ## environmental vars
-    if not opt['e']:      additional_options+='\n#$ -V '
-    ## memory
-    mem_specs='\n#$ -l virtual_free={m}G'.format(m=opt['m']) if opt['m'] else ''
-    ## cpus
-    parallelization=opt['pe']    if not queue_name in pe_table else pe_table[queue_name]
-    cpu_specs=sge_pe_template.format(procs=opt['p'], pe=parallelization)     if opt['p'] else ''
-   
-  elif opt['sys']=='slurm':
-    ## queue or partition
-    queue_line= "\n#SBATCH -p {}".format(queue_name) if (queue_name and queue_name!='0')else ''
-    ## time constraint
-    time_line=  '\n#SBATCH -t 0-{h}:{m}'.format(h=time_limit_minutes//60, m=time_limit_minutes%60)  if not time_limit_minutes is None else ''
-    ## email
-    if opt['E']:          
-      sge_mail_codes2slurm_code={'a':'FAIL', 'b':'BEGIN', 'e':'END', 'v':'ALL'}
-      for code in opt['E']: 
-        if not code in sge_mail_codes2slurm_code: raise notracebackException("ERROR this -E option is not valid for slurm: {}".format(code))
-        additional_options+='\n#SBATCH --mail-type={}'.format(sge_mail_codes2slurm_code[code])
-    ## environmental vars
-    if not opt['e']:        additional_options+='\n#SBATCH --export ALL'
-    ## memory
-    mem_specs='\n#SBATCH --mem={m}G'.format(m=opt['m']) if opt['m'] else ''
-    ## cpus
-    cpu_specs=slurm_pe_template.format(procs=opt['p']) if opt['p'] else ''
-    if opt['qos']:
-      additional_options+="\n#SBATCH -q {}".format(opt['qos'])
-    
-  ## easy handled options:
-  submit_add_options=opt['so']
-  suffix_out='LOG'
-  suffix_err='ERR' if not opt['joe'] else 'LOG'
+    os.mkdir(output_folder)
+  elif os.path.isdir(output_folder):
+    if not opt['f']:
+      if not ( input(f'Jobs folder {output_folder}/ existing from a previous run; update it?\n'
+                   f'Only job files whose content changed are rewritten, and only their log files are deleted.\n'
+                   f'(Use -clean to delete all previous files instead)\nReply= [Y] ') 
+                   in ['', 'Y', 'y', 'yes'] ):
+        raise NoTracebackError("Aborted. ")
+    previous_manifest=read_manifest(output_folder)
+  else:
+    os.mkdir(output_folder)
+  timer.lap('folder')
+
+  ### job files text: scheduler header, commands
+  script=JobScript(opt, dependency_ids=dependency_ids)
+  suffix_out, suffix_err, task_id_var= script.suffix_out, script.suffix_err, script.task_id_var
+
+  ### -qload: a snapshot of the load of the candidate queues, to assign each job to one of them
+  balancer=None
+  if opt['qload']:
+    candidate_queues=[q for q in script.queue_name.split(',') if q]
+    if opt['sys']=='local' or len(candidate_queues)<2:
+      raise NoTracebackError('qjob ERROR option -qload requires -sys sge or slurm, and several queues in -q (or in its synonym in -qsyn)')
+    loads=query_queue_loads(opt['sys'], candidate_queues)
+    try:
+      balancer=QueueBalancer(loads, candidate_queues)
+    except ValueError as e:
+      raise NoTracebackError(f'qjob ERROR option -qload: {e}') from None
+    write('Queue load: ' + '  '.join([f'{q} {loads[q].used}/{loads[q].total} used, {loads[q].pending} pending'
+                                      for q in candidate_queues if q in loads]))
+  queue_scripts={}   # (id of JobScript, queue) -> JobScript for that queue
+  def assign_queue(job_script, n_tasks=1):
+    """ With -qload, returns a JobScript like job_script for the queue where a job (or an array job of n_tasks) is expected to
+    wait less, recording the assignment. Otherwise, returns job_script """
+    if balancer is None:
+      return job_script
+    queue=balancer.assign( (int(job_script.opt['p']) if job_script.opt['p'] else 1) * n_tasks )
+    key=(id(job_script), queue)
+    if not key in queue_scripts:
+      queue_scripts[key]=JobScript(dict(job_script.opt, q=queue), dependency_ids=dependency_ids)
+    return queue_scripts[key]
+
+  to_submit=[]
+  job_records=[]   # tuples (job_index, name, file, submit_file, task_id, first_line, last_line, n_lines) for the job-state database
+  manifest={} if (previous_manifest is None or not opt['resume']) else dict(previous_manifest)   # see read_manifest
+  n_unchanged=0
+  def write_job_file(outfile, content, array=False, job_index='', logout='', logerr=''):
+    """ Writes a job file and records it in the manifest, with its content hash. When updating a jobs folder, the file is not rewritten
+    if its content is the same as in the previous run, so its logs are kept; otherwise its previous logs are deleted.
+    Returns True if the file was written, False if unchanged """
+    nonlocal n_unchanged
+    start=time.perf_counter()
+    digest=hashlib.sha1(content.encode()).hexdigest()
+    manifest_key=os.path.relpath(outfile, output_folder)
+    manifest[manifest_key]=[digest, job_index,
+                            os.path.relpath(logout, output_folder) if logout else '',
+                            os.path.relpath(logerr, output_folder) if logerr else '']
+    if not previous_manifest is None:
+      if previous_manifest.get(manifest_key, [None])[0]==digest and os.path.isfile(outfile):
+        n_unchanged+=1
+        timer.phases['file_writing']=timer.phases.get('file_writing', 0.0) + time.perf_counter()-start
+        return False
+      remove_job_files(outfile, array=array, keep_job_file=True)
+    with open(outfile, 'w') as ofh:
+      ofh.write(content)
+    timer.phases['file_writing']=timer.phases.get('file_writing', 0.0) + time.perf_counter()-start
+    return True
+
+  shard_folders=set()
+  def job_file_path(job_index, name):
+    """ Returns the path of a job file. With -shard, job files (and their logs) are placed in subfolders jobs/000/, jobs/001/ ...
+    each containing the number of jobs given as argument """
+    if not opt['shard']:
+      return os.path.abspath(f'{output_folder}/{name}')
+    shard_folder=os.path.abspath(f'{output_folder}/jobs/{(job_index-1)//opt["shard"]:03d}')
+    if not shard_folder in shard_folders:
+      os.makedirs(shard_folder, exist_ok=True)
+      shard_folders.add(shard_folder)
+    return f'{shard_folder}/{name}'
+
+  progress=Progress('Job files written', verbose=opt['v'],
+                    total=min(opt['njobs'], tot_lines) if (opt['njobs'] and not opt['arr'] and not opt['cost']) else None)
+
+  def submit_job(outfile):
+    """ Marks a job file for submission to the queue, if option -qsub is active. Submission occurs after all files are written """
+    if opt['qsub']:
+      to_submit.append(outfile)
 
-  def write_job(cmd, name, outfile, output_folder):
-    """ Takes the command, plus all other variables computed and available in namespace, prepares a single job file and submit it if necessary"""
+  def write_job(job_commands, line_indices, job_index, name, outfile, output_folder, job_script=script):
+    """ Takes the command, plus all other variables computed and available in namespace, prepares a single job file and submit it if necessary.
+    job_script is the JobScript producing its text; with -res, the one of its resource group """
     logout='{outfile}.{suf}'.format(outfile=outfile, suf=suffix_out)
     logerr='{outfile}.{suf}'.format(outfile=outfile, suf=suffix_err)
     if opt['sl']:
       logout='{outfolder}output_all_jobs.{suf}'.format(outfolder=output_folder, suf=suffix_out)
       logerr='{outfolder}output_all_jobs.{suf}'.format(outfolder=output_folder, suf=suffix_err)
 
-    write('Writing file: '+outfile, end=' ')
-    if   opt['sys']=='sge':
-      header=sge_header_single_job.format(email=opt['email'],
-                                          additional_options=additional_options,
-                                          queue_line=queue_line, 
-                                          time_line=time_line,
-                                          name=name,
-                                          outfile=outfile,
-                                          cpus=cpu_specs,
-                                          mem=mem_specs,
-                                          logout=logout,
-                                          logerr=logerr)
-    elif opt['sys']=='slurm':
-      append_add='\n#SBATCH --open-mode=append'  if opt['sl'] else ''
-      if opt['srun']: cmd='\n'.join( ['srun '+x for x in [i.strip() for i in cmd.split('\n') if i.strip()]] )
-      header=slurm_header_single_job.format(email=opt['email'],
-                                            additional_options=additional_options + append_add,
-                                            queue_line=queue_line, 
-                                            time_line=time_line,
-                                            name=name,
-                                            outfile=outfile,
-                                            cpus=cpu_specs,
-                                            mem=mem_specs,
-                                            logout=logout,
-                                            logerr=logerr)
-
-    with open(outfile, 'w') as ofh:
-      ofh.write(header + init_command.rstrip('\n') + '\n' +
-                cmd.rstrip('\n')+'\n'+
-                footer_command)
-      
-    if opt['qsub']:
-      write(' \tsubmitting file! ', end='')
-      if   opt['sys']=='sge':
-        run_cmd(f'qsub {submit_add_options} {outfile}')        
-      elif opt['sys']=='slurm':
-        run_cmd(f'sbatch {submit_add_options} {outfile}')        
-    write('')
+    is_written=write_job_file(outfile, job_script.header(name, outfile, logout, logerr) +
+                                       job_script.body(job_commands, line_indices, status_file=outfile+'.status'),
+                              job_index=job_index, logout=logout, logerr=logerr)
+    progress.update(('Writing file: ' if is_written else 'Unchanged file: ')+outfile)
+    submit_job(outfile)
 
-  def write_array_job(cmd, name, outfile, arr_range, output_folder):
-    """ Takes the command list, plus all other variables computed and available in namespace, prepares an array file and submit it if necessary"""
+  def write_array_job(body, name, outfile, arr_range, output_folder, job_script=script):
+    """ Takes the commands of the array job, plus all other variables computed and available in namespace, prepares an array file and submit it if necessary"""
     write(f'Writing array file : {outfile}', end=' ')
-    if   opt['sys']=='sge':
+    if   opt['sys'] in ('sge', 'local'):
       logout='{outfile}.$TASK_ID.{suf}'.format(outfile=outfile, suf=suffix_out)
       logerr='{outfile}.$TASK_ID.{suf}'.format(outfile=outfile, suf=suffix_err)
-      if opt['sl']: 
-        logout='{outfile}.{suf}'.format(outfile=outfile, suf=suffix_out)
-        logerr='{outfile}.{suf}'.format(outfile=outfile, suf=suffix_err)
-
-      header=sge_header_array_job.format(email=opt['email'],
-                                         additional_options=additional_options,
-                                         queue_line=queue_line, 
-                                         time_line=time_line,
-                                         name=name,
-                                         outfile=outfile,
-                                         cpus=cpu_specs,
-                                         mem=mem_specs,
-                                         logout=logout,
-                                         logerr=logerr,
-                                         range_str=arr_range)
-
     elif opt['sys']=='slurm':
       logout='{outfile}.%a.LOG'.format(outfile=outfile)
       logerr='{outfile}.%a.ERR'.format(outfile=outfile)
-      if opt['sl']: 
+    if opt['sl']:
+      logout='{outfile}.{suf}'.format(outfile=outfile, suf=suffix_out)
+      logerr='{outfile}.{suf}'.format(outfile=outfile, suf=suffix_err)
+
+    write_job_file(outfile, job_script.header(name, outfile, logout, logerr, range_str=arr_range) + body,
+                   array=True, logout=logout, logerr=logerr)
+    submit_job(outfile)
+    write('')
+
+  def write_packed_array_job(name, outfile, n_jobs, output_folder, job_prefix=prefix_name, job_script=script):
+    """ Prepares an array file whose task N runs the job body file {job_prefix}.N, and submit it if necessary.
+    Log files are named as the ones of single jobs (honouring -joe and -sl)"""
+    write(f'Writing array file : {outfile}', end=' ')
+    task_log_var='$TASK_ID' if opt['sys']!='slurm' else '%a'
+    job_base=os.path.abspath(f'{output_folder}/{job_prefix}')
+    logout='{base}.{tid}.{suf}'.format(base=job_base, tid=task_log_var, suf=suffix_out)
+    logerr='{base}.{tid}.{suf}'.format(base=job_base, tid=task_log_var, suf=suffix_err)
+    if opt['sl']:
+      logout='{outfolder}output_all_jobs.{suf}'.format(outfolder=output_folder, suf=suffix_out)
+      logerr='{outfolder}output_all_jobs.{suf}'.format(outfolder=output_folder, suf=suffix_err)
+    dispatch=f'bash {job_base}.{task_id_var}\n'
+    append=False
+
+    if opt['shard']:
+      # job bodies are in subfolders, computed from the task ID. Without -sl, their paths can't be expressed in scheduler
+      # log paths: the array job redirects their output to log files next to them, while any message of the scheduler
+      # itself goes to a single log file
+      shard_expr=f'$(printf %03d $(( ({task_id_var}-1) / {opt["shard"]} )))'
+      body_line=f'qjob_body={os.path.abspath(output_folder)}/jobs/{shard_expr}/{job_prefix}.{task_id_var}\n'
+      if opt['sl']:
+        dispatch=body_line + 'bash "$qjob_body"\n'
+      else:
+        redirect_err='2>&1' if suffix_err==suffix_out else f'2>> "$qjob_body.{suffix_err}"'
+        dispatch=body_line + f'bash "$qjob_body" >> "$qjob_body.{suffix_out}" {redirect_err}\n'
         logout='{outfile}.{suf}'.format(outfile=outfile, suf=suffix_out)
         logerr='{outfile}.{suf}'.format(outfile=outfile, suf=suffix_err)
-      append_add='\n#SBATCH --open-mode=append'  if opt['sl'] else ''        
-
-      header=slurm_header_array_job.format(email=opt['email'],
-                                           additional_options=additional_options + append_add,
-                                           queue_line=queue_line, 
-                                           time_line=time_line,
-                                           name=name,
-                                           outfile=outfile,
-                                           cpus=cpu_specs,
-                                           mem=mem_specs,
-                                           logout=logout,
-                                           logerr=logerr,
-                                           range_str=arr_range)
-      if opt['srun']: cmd='\n'.join( ['srun ' + i.strip()   for i in cmd.split('\n') if i.strip()] )
+        append=True
 
-    with open(outfile, 'w') as ofh:
-      ofh.write(header + init_command.rstrip('\n') + '\n' +
-                cmd.rstrip('\n')+'\n'+
-                footer_command)
-
-    if opt['qsub']:
-      write(' \tsubmitting file! ', end='')
-      if   opt['sys']=='sge':
-        run_cmd(f'qsub {submit_add_options} {outfile}')
-      elif opt['sys']=='slurm':
-        run_cmd(f'sbatch {submit_add_options} {outfile}')
+    write_job_file(outfile, job_script.header(name, outfile, logout, logerr, range_str=f'1-{n_jobs}', append=append) + dispatch,
+                   logout=logout, logerr=logerr)
+    submit_job(outfile)
     write('')
 
-      
+  def write_indexed_array_job(cmd_iter, name, outfile, output_folder):
+    """ Writes the commands of all jobs to {outfile}.cmds, and the byte offset where each starts to {outfile}.idx (see
+    scripts.index_dispatch_template); then prepares an array file whose task N runs job N, and submit it if necessary"""
+    start=time.perf_counter()
+    cmds_file, idx_file= outfile+'.cmds', outfile+'.idx'
+    sha1=hashlib.sha1()
+    offset=0
+    with open(cmds_file, 'wb') as cmds_fh, open(idx_file, 'wb') as idx_fh:
+      for job_index, (line_indices, job_commands) in enumerate(cmd_iter, 1):
+        data=script.commands(job_commands, line_indices, status_file=outfile+'.status').encode()
+        idx_fh.write( f'{offset:{index_width-1}d}\n'.encode() )
+        cmds_fh.write(data)
+        sha1.update(data)
+        progress.update(f'Indexing job {job_index}: {len(line_indices)} line(s) at byte {offset}')
+        offset+=len(data)
+        job_records.append( (job_index, f'{name}.{job_index}', outfile, outfile, job_index,
+                             min(line_indices), max(line_indices), len(line_indices)) )
+      idx_fh.write( f'{offset:{index_width-1}d}\n'.encode() )
+    timer.phases['file_writing']=timer.phases.get('file_writing', 0.0) + time.perf_counter()-start
+    write(f'Indexed jobs: {progress.n} in {cmds_file} ({time.perf_counter()-progress.start:.1f} seconds)')
+    write_array_job(script.index_body(cmds_file, idx_file, sha1.hexdigest(), status_file=outfile+'.status'),
+                    name, outfile, f'1-{progress.n}', output_folder,
+                    job_script=assign_queue(script, progress.n))
+
   ######## array mode
   if opt['arr']:
     name=prefix_name 
     outfile=os.path.abspath(output_folder+'/'+name)
-    cmd='\n'.join(cmd_lines)   # array mode wants a single job submitted (with TASK_ID)    
-    write_array_job(cmd, name, outfile, opt['arr'], output_folder)
+    job_commands=[cmd for _, cmd in cmd_lines]   # array mode wants a single job submitted (with TASK_ID)
+    write_array_job(script.body(job_commands), name, outfile, opt['arr'], output_folder,
+                    job_script=assign_queue(script, len(parse_range(opt['arr']))))
+    job_records.extend( [(task_id, name, outfile, outfile, task_id, 0, len(job_commands)-1, len(job_commands))
+                         for task_id in parse_range(opt['arr'])] )
 
   ####### normal mode
   else:    
     ## from here it goes only if we're not in array job mode
     # producing a "cmd" variable with all the lines to put in a job; then we write (and submit it)
 
-    if opt['njobs']:
-      cmd_iter= divide(opt['njobs'], cmd_lines)
+    if opt['cost']:
+      # balancing jobs by cost: all lines are needed before writing any job
+      cmd_lines=list(cmd_lines)
+      all_costs=list(line_costs_iterator())
+      costs=[ all_costs[line_index]  for line_index, _ in cmd_lines ]
+      n_jobs=opt['njobs'] if opt['njobs'] else -(-len(cmd_lines) // opt['nlines'])
+      job_positions, job_loads= pack_by_cost(costs, n_jobs)
+      cmd_iter=unzip_jobs( [ [cmd_lines[k] for k in positions]  for positions in job_positions ] )
+      with open(f'{output_folder}/job_loads.tsv', 'w') as ofh:
+        ofh.write('job\tn_lines\tpredicted_load\n')
+        for job_index, (positions, load) in enumerate(zip(job_positions, job_loads), 1):
+          ofh.write(f'{prefix_name}.{job_index}\t{len(positions)}\t{load:g}\n')
+      write(f'Jobs balanced by cost: {len(job_loads)} jobs, predicted load per job  max={max(job_loads):g}  '
+            f'mean={sum(job_loads)/len(job_loads):g}  min={min(job_loads):g}  (see {output_folder}/job_loads.tsv)')
+    elif opt['njobs']:
+      cmd_iter= unzip_jobs( split_in_jobs(cmd_lines, tot_lines, opt['njobs']) )
+    elif not opt['res']:
+      cmd_iter= unzip_jobs( chunked(cmd_lines, opt['nlines']) )
+
+    # job_groups: list of tuples (job_script, job_prefix, cmd_iter); more than one only with -res, one per resource signature
+    if opt['res']:
+      # lines with the same resources are grouped: all lines are needed before writing any job
+      cmd_lines=list(cmd_lines)
+      all_signatures=list(line_resources_iterator())
+      groups={}   # signature -> list of tuples (line_index, command), in order of first appearance
+      for line_index, cmd in cmd_lines:
+        groups.setdefault(all_signatures[line_index], []).append( (line_index, cmd) )
+      job_groups=[]
+      for group_index, (signature, group_lines) in enumerate(groups.items(), 1):
+        job_script=JobScript(dict(opt, **dict(zip(resource_options, signature))), dependency_ids=dependency_ids)
+        job_groups.append( (job_script, f'{prefix_name}.g{group_index}', unzip_jobs(chunked(group_lines, opt['nlines']))) )
+        write(f'Resource group g{group_index}: ' + '  '.join([f'-{o} {v}' for o, v in zip(resource_options, signature)]) +
+              f'  ({len(group_lines)} line(s))')
     else:
-      cmd_iter= chunked(cmd_lines, opt['nlines'])
-    
-    for job_index, job_commands in enumerate(cmd_iter, 1):
-      cmd='\n'.join(job_commands)
-      name=f'{prefix_name}.{job_index}'
-      outfile=os.path.abspath(f'{output_folder}/{name}')
-      write_job(cmd, name, outfile, output_folder) 
+      job_groups=[ (script, prefix_name, cmd_iter) ]
+
+    if opt['index']:
+      write_indexed_array_job(cmd_iter, prefix_name, os.path.abspath(f'{output_folder}/{prefix_name}'), output_folder)
+
+    elif opt['pack']:
+      # writing only job bodies; a single array job (per resource group) dispatching to them is written and submitted at the end
+      job_index=0
+      for job_script, job_prefix, cmd_iter in job_groups:
+        array_outfile=os.path.abspath(f'{output_folder}/{job_prefix}.array')
+        for task_index, (line_indices, job_commands) in enumerate(cmd_iter, 1):
+          job_index+=1
+          outfile=job_file_path(task_index, f'{job_prefix}.{task_index}')
+          is_written=write_job_file(outfile, '#!/bin/bash\n' + job_script.body(job_commands, line_indices, status_file=outfile+'.status'),
+                                    job_index=job_index, logout=f'{outfile}.{suffix_out}', logerr=f'{outfile}.{suffix_err}')
+          progress.update(('Writing file: ' if is_written else 'Unchanged file: ')+outfile)
+          job_records.append( (job_index, f'{job_prefix}.{task_index}', outfile, array_outfile, task_index,
+                               min(line_indices), max(line_indices), len(line_indices)) )
+        write_packed_array_job(job_prefix, array_outfile, task_index, output_folder, job_prefix=job_prefix,
+                               job_script=assign_queue(job_script, task_index))
+
+    else:
+      # with -res, jobs are numbered across resource groups
+      job_index=0
+      for job_script, _, cmd_iter in job_groups:
+        for line_indices, job_commands in cmd_iter:
+          job_index+=1
+          name=f'{prefix_name}.{job_index}'
+          outfile=job_file_path(job_index, name)
+          write_job(job_commands, line_indices, job_index, name, outfile, output_folder, job_script=assign_queue(job_script))
+          job_records.append( (job_index, name, outfile, outfile, None,
+                               min(line_indices), max(line_indices), len(line_indices)) )
+
+  if not balancer is None:
+    write('Processors assigned per queue: ' + '  '.join([f'{q} {n}' for q, n in balancer.assigned.items()]))
+  if not opt['arr'] and not opt['index']:
+    write(f'Job files: {progress.n} in {output_folder}/ ({time.perf_counter()-progress.start:.1f} seconds)')
+  timer.lap('generation')
+  run_counts.update({'lines':job_records[0][7]  if opt['arr'] else  sum([r[7] for r in job_records]),
+                     'jobs':len(job_records),
+                     'job_files':len(manifest),
+                     'job_files_unchanged':n_unchanged})
+
+  ####### updating the manifest of job files; removing files of the previous run that were not generated again
+  if not previous_manifest is None and not opt['resume']:
+    stale_files=[f for f in previous_manifest if not f in manifest]
+    for manifest_key in stale_files:
+      remove_job_files( os.path.join(output_folder, manifest_key), array=True )
+    for stale_folder in set([os.path.dirname(f) for f in stale_files]) - set(['']):
+      try:
+        os.rmdir( os.path.join(output_folder, stale_folder) )   # only if empty
+      except OSError:
+        pass
+    write(f'Jobs folder updated: {len(manifest)-n_unchanged} job file(s) written, {n_unchanged} unchanged, '
+          f'{len(stale_files)} removed')
+    if os.path.isfile(os.path.join(output_folder, db_filename)):
+      os.remove(os.path.join(output_folder, db_filename))   # jobs are recorded anew
+  write_manifest(output_folder, manifest)
+  if not hashes is None:
+    write_hashes(output_folder, hashes)
+  timer.lap('manifest')
+
+  ####### recording jobs in the job-state database
+  jobdb=JobDB(output_folder)
+  jobdb.set_info(sys=opt['sys'], name=prefix_name, round=resume_round,
+                 m=opt['m'] if opt['m'] else 0, t=script.time_limit_minutes or 0, p=opt['p'] if opt['p'] else 1)   # for qjob report
+  jobdb.add_jobs(job_records, round=resume_round)
+  timer.lap('jobdb')
+
+  ####### submission
+  try:
+    if to_submit and opt['sys']=='local':
+      run_all_locally(to_submit, opt, jobdb)
+    elif to_submit:
+      submit_all(to_submit, opt, output_folder, jobdb, all_results=submission_results)
+  finally:
+    jobdb.close()
+    if to_submit:
+      timer.lap('local_run' if opt['sys']=='local' else 'submission')
+    save_performance_reports()
 
   write('\nqjob: all done, quitting')
+  return output_folder
+
+
+#########################################################
+###### subcommands
+
+status_def_opt={'i':'', 'sys':''}
+
+status_help_msg="""qjob status: show the state of the jobs in a jobs folder
+
+#### Usage:   qjob status  jobs_folder.jbs
+
+The state of jobs is refreshed with a single call to qstat (SGE) or squeue (Slurm), then stored in the
+job-state database (file qjob.db inside the jobs folder). Counts of jobs per state are displayed.
+States: written (not submitted), submitted, pending, running, error, finished (not in the queue anymore),
+        done and failed (known exit status, e.g. with -sys local)
+
+### Options:
+-sys     cluster system; by default, the one used to create the jobs folder
+"""
+
+def status_main(arglist):
+  """Subcommand qjob status: refreshes the state of jobs in a jobs folder, and prints counts per state """
+  opt=command_line_options(status_def_opt, status_help_msg, 'i', arglist=arglist)
+  folder=opt['i'].rstrip('/')
+  if not folder or not os.path.isfile(os.path.join(folder, db_filename)):
+    raise NoTracebackError(f'qjob ERROR you must provide a jobs folder created by qjob (missing {os.path.join(folder, db_filename)})')
+  jobdb=JobDB(folder)
+  system=opt['sys'] if opt['sys'] else jobdb.get_info('sys')
+  if system in ('sge', 'slurm') and jobdb.sched_ids():
+    n_changed=jobdb.refresh( query_queue(system) )
+    write(f'Queue checked: {n_changed} job(s) changed state')
+  counts=jobdb.state_counts()
+  jobdb.close()
+  write(f'Jobs in {folder}/ :')
+  for state, count in counts:
+    write(f'   {state:<10} {count:>9}')
+  write(f'   {"total":<10} {sum([c for _, c in counts]):>9}')
+
+report_def_opt={'i':'', 'sys':'', 'tsv':''}
+
+report_help_msg="""qjob report: resources used by the finished jobs of a jobs folder, and recommended requests
+
+#### Usage:   qjob report  jobs_folder.jbs  [-tsv usage.tsv]
+
+The wall time, maximum memory (RSS), cpu time and exit state of all finished jobs are read from the accounting of
+the scheduler with a single call to sacct (Slurm) or qacct (SGE), then summarized as distributions over jobs.
+Values of -m, -t, -p fitting all jobs with 20% headroom are recommended, together with the efficiency of the
+batch: the fraction of requested cpu, memory and time actually used (1 is best). The state of jobs (done, failed)
+is recorded in the job-state database, as shown by qjob status.
+
+### Options:
+-tsv     write the resources used by each job to this file
+-sys     cluster system; by default, the one used to create the jobs folder
+"""
+
+def report_main(arglist):
+  """Subcommand qjob report: reads the resources used by the jobs of a jobs folder from the scheduler accounting, and prints a
+  summary with recommended resources """
+  opt=command_line_options(report_def_opt, report_help_msg, 'i', arglist=arglist)
+  folder=opt['i'].rstrip('/')
+  if not folder or not os.path.isfile(os.path.join(folder, db_filename)):
+    raise NoTracebackError(f'qjob ERROR you must provide a jobs folder created by qjob (missing {os.path.join(folder, db_filename)})')
+  jobdb=JobDB(folder)
+  try:
+    system=opt['sys'] if opt['sys'] else jobdb.get_info('sys')
+    if not system in ('sge', 'slurm'):
+      raise NoTracebackError(f'qjob ERROR qjob report reads the accounting of sge or slurm, not: {system}')
+    jobs=jobdb.submitted_jobs()
+    if not jobs:
+      raise NoTracebackError(f'qjob ERROR no jobs in {folder}/ were submitted')
+    usage=query_accounting(system, set([sched_id for _, sched_id, _ in jobs]))
+    jobdb.record_accounting( [(u.sched_id, u.task_id, u.state, u.exit_status) for u in usage.values()] )
+    requested={'m':float(jobdb.get_info('m', 0)), 't':int(jobdb.get_info('t', 0)), 'p':int(jobdb.get_info('p', 1))}
+  finally:
+    jobdb.close()
+
+  # jobs of array files (-arr, -pack, -index) are its tasks, identified by task ID
+  usages=[ usage[(sched_id, task_id)]  for _, sched_id, task_id in jobs  if (sched_id, task_id) in usage ]
+  if opt['tsv']:
+    with open(opt['tsv'], 'w') as ofh:
+      ofh.write('name\tsched_id\ttask_id\tstate\texit_status\twall_seconds\tcpu_seconds\tmax_rss_gb\tncpus\n')
+      for name, sched_id, task_id in jobs:
+        if (sched_id, task_id) in usage:
+          u=usage[(sched_id, task_id)]
+          ofh.write(f'{name}\t{sched_id}\t{"" if task_id is None else task_id}\t{u.state}\t{u.exit_status}\t'
+                    f'{u.wall_seconds:g}\t{u.cpu_seconds:g}\t{u.max_rss_gb:.3f}\t{u.ncpus}\n')
+    write(f'Resources used by each job written to {opt["tsv"]}')
+
+  write(f'Jobs in {folder}/ : {len(jobs)} submitted, {len(usages)} finished '
+        f'({sum([u.state=="done" for u in usages])} done, {sum([u.state=="failed" for u in usages])} failed)')
+  if not usages:
+    write('No finished jobs found in the accounting of the scheduler yet')
+    return
+  write(f'   {"":<18} {"min":>9} {"median":>9} {"95%":>9} {"max":>9}')
+  for label, values in [('wall time (min)', [u.wall_seconds/60 for u in usages]),
+                        ('max memory (GB)', [u.max_rss_gb for u in usages]),
+                        ('cpu efficiency',  [u.cpu_efficiency for u in usages if not u.cpu_efficiency is None])]:
+    if values:
+      write(f'   {label:<18} ' + ' '.join([f'{percentile(values, q):>9.2f}' for q in (0, 50, 95, 100)]))
+
+  recommended=recommend_resources(usages)
+  write(f'Requested:    -m {requested["m"]:g}  -t {str(requested["t"])+"m" if requested["t"] else 0}  -p {requested["p"]}')
+  write(f'Recommended:  -m {recommended["m"]}  -t {recommended["t"]}  -p {recommended["p"]}')
+  scores=efficiency_scores(usages, requested_memory_gb=requested['m'], requested_minutes=requested['t'])
+  if scores:
+    write('Efficiency:   ' + '  '.join([f'{k}={v:.2f}' for k, v in scores.items()]))
+
+feed_def_opt={'i':'', 'sys':'', 'max':5000, 'rate':10.0, 'wait':60, 'so':'', 'sw':8, 'sa':5}
+
+feed_help_msg="""qjob feed: submit the jobs of a jobs folder as the queue frees up
+
+#### Usage:   qjob feed  jobs_folder.jbs  [-max 5000] [-rate 10] [-wait 60]
+
+Use it to submit more jobs than allowed in the queue at once. Write the jobs folder with qjob without -qsub
+(or use a folder whose submission was interrupted), then run qjob feed on it. In each cycle, the queue
+is checked with a single call to qstat (SGE) or squeue (Slurm); then jobs not yet submitted are
+submitted until the queue contains -max jobs, and qjob feed sleeps until the next cycle.
+All your jobs in the queue are counted, including those of other workloads; each array task counts as a job.
+Submissions are recorded in the job-state database (qjob.db) as they occur, so qjob feed can be stopped
+(e.g. with Ctrl+C) and run again: jobs already submitted are not submitted again.
+
+### Options:
+-max     maximum number of jobs of yours in the queue (pending, running or in error)
+-rate    maximum number of submissions (qsub or sbatch calls) per second; 0 for no limit
+-wait    seconds between queue checks
+-so      options for qsub (sge) or sbatch (slurm). Use quotes: e.g. -so " -tc 5 "
+-sw      number of submissions run concurrently
+-sa      max attempts for each submission, retrying temporary scheduler failures
+-sys     cluster system; by default, the one used to create the jobs folder
+"""
+
+def feed_files(outfiles, system, opt, jobdb, folder):
+  """Submits job files for qjob feed, at most opt['rate'] per second. Job IDs are recorded in the job-state database and in
+  submitted_jobs.tsv after each group of submissions. Raises NoTracebackError if any submission failed """
+  group_size=max(1, int(opt['rate'])) if opt['rate']>0 else max(1, opt['sw'])
+  for group in chunked(outfiles, group_size):
+    start=time.perf_counter()
+    results=list( submit_jobs(group, system, opt['so'], workers=opt['sw'], max_attempts=opt['sa']) )
+    submitted=[(r.outfile, r.job_id)  for r in results  if not r.job_id is None]
+    jobdb.record_submissions(submitted)
+    with open(f'{folder}/submitted_jobs.tsv', 'a') as ofh:
+      for outfile, job_id in submitted:
+        ofh.write(f'{outfile}\t{job_id}\n')
+    failed=[r for r in results if r.job_id is None and r.attempts]
+    if failed:
+      for r in failed:
+        printerr(f'qjob ERROR submitting {r.outfile} after {r.attempts} attempt(s):\n{r.error}')
+      raise NoTracebackError(f'qjob ERROR {len(failed)} job file(s) could not be submitted. '
+                             f'Fix the problem, then run qjob feed again to submit the remaining jobs')
+    if opt['rate']>0:
+      time.sleep( max(0, len(group)/opt['rate'] - (time.perf_counter()-start)) )
+
+def feed_main(arglist):
+  """Subcommand qjob feed: submits the jobs of a jobs folder not yet submitted, keeping at most opt['max'] jobs in the queue """
+  opt=command_line_options(feed_def_opt, feed_help_msg, 'i', arglist=arglist)
+  folder=opt['i'].rstrip('/')
+  if not folder or not os.path.isfile(os.path.join(folder, db_filename)):
+    raise NoTracebackError(f'qjob ERROR you must provide a jobs folder created by qjob (missing {os.path.join(folder, db_filename)})')
+  if opt['max']<1:
+    raise NoTracebackError('qjob ERROR -max must be a positive number')
+  jobdb=JobDB(folder)
+  system=opt['sys'] if opt['sys'] else jobdb.get_info('sys')
+  if not system in ('sge', 'slurm'):
+    raise NoTracebackError(f'qjob ERROR qjob feed can only submit to sge or slurm, not: {system}')
+
+  n_submitted=0
+  try:
+    while True:
+      to_submit=jobdb.written_files()
+      if not to_submit:
+        break
+      queue_states=query_queue(system)
+      jobdb.refresh(queue_states)
+      n_free=opt['max']-len(queue_states)
+      batch=[]
+      for submit_file, n_jobs in to_submit:
+        # an array job with more tasks than -max is submitted only when the queue is empty
+        if n_jobs>n_free and (batch or queue_states):
+          break
+        batch.append(submit_file)
+        n_free-=n_jobs
+      feed_files(batch, system, opt, jobdb, folder)
+      n_submitted+=len(batch)
+      write(f'{time.strftime("%Y-%m-%d %H:%M:%S")}  jobs in queue: {len(queue_states)}  submitted now: {len(batch)}  '
+            f'submitted in total: {n_submitted}  left: {len(to_submit)-len(batch)}')
+      if len(batch)==len(to_submit):
+        break
+      time.sleep(opt['wait'])
+  finally:
+    jobdb.close()
+  write(f'\nqjob feed: all jobs in {folder}/ were submitted')
+
+workflow_help_msg="""qjob workflow: submit all stages of a pipeline at once, wired by scheduler dependencies
+
+#### Usage:   qjob workflow  stages.txt  [options added to all stages, e.g. -Q]
+
+File stages.txt contains one line per stage, with the qjob options of that stage (input, resources...), e.g.:
+   -i scatter_commands.sh  -njobs 100  -o scatter  -t 2
+   -c gather_template.sh  -d samples.tsv  -o gather  -m 20
+Stages are written (and submitted, with -Q) in order. Each stage depends on the previous one: its jobs
+start only after all jobs of the previous stage completed successfully (-hold_jid in SGE, --dependency=afterok
+in Slurm). Add -after to a stage to choose its dependencies instead, e.g. "-after scatter,other"; use "-after 0"
+for no dependencies. Add -aftercorr to a stage for task-to-task dependencies between array jobs (see qjob -h).
+Lines starting with # are ignored.
+"""
+
+def workflow_main(arglist):
+  """Subcommand qjob workflow: runs qjob for each stage (line) of a stages file, each depending on the previous one """
+  if not arglist or arglist[0] in ('-h', '-help', '--help'):
+    write(workflow_help_msg)
+    return
+  stages_file, common_args=arglist[0], arglist[1:]
+  check_file_presence(stages_file, 'stages file')
+  with open(stages_file) as fh:
+    stages=[shlex.split(line)  for line in fh  if line.strip() and not line.strip().startswith('#')]
+  previous_folder=None
+  for stage_index, stage_args in enumerate(stages, 1):
+    stage_args=stage_args+common_args
+    if not '-after' in stage_args and not previous_folder is None:
+      stage_args+=['-after', previous_folder]
+    write(f'\nqjob workflow: stage {stage_index} of {len(stages)}:  {" ".join(stage_args)}')
+    previous_folder=run(arglist=stage_args)
+  write(f'\nqjob workflow: all {len(stages)} stages done')
+
+server_def_opt={'socket':'', 'sw':8, 'sa':5}
+
+server_help_msg="""qjob server: submit job files on behalf of all qjob processes of yours
+
+#### Usage:   qjob server  [-sw 8] [-socket ~/.qjob.sock]
+
+Use it when many qjob processes (e.g. those of workflow managers) submit jobs at the same time.
+The server listens on a unix socket; while it runs, qjob hands job files to it instead of calling qsub/sbatch
+itself. A single pool of workers submits the files of all clients, taking them in turn, so that a qjob
+call with many jobs does not delay the others; job IDs are returned to each caller.
+Stop the server with Ctrl+C; qjob then goes back to submitting by itself.
+
+### Options:
+-socket  path of the unix socket (default: ~/.qjob.sock)
+-sw      number of submissions (qsub or sbatch calls) run concurrently
+-sa      max attempts for each submission, retrying temporary scheduler failures
+"""
+
+def server_main(arglist):
+  """Subcommand qjob server: runs a submission server until interrupted """
+  opt=command_line_options(server_def_opt, server_help_msg, arglist=arglist)
+  socket_path=opt['socket'] if opt['socket'] else default_socket_path
+  try:
+    server=SubmissionServer(socket_path, workers=opt['sw'], max_attempts=opt['sa'])
+  except OSError as e:
+    raise NoTracebackError(f'qjob ERROR cannot start the server: {e}') from None
+  write(f'qjob server listening on {socket_path} with {opt["sw"]} submission workers. Stop it with Ctrl+C')
+  signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))   # e.g. kill: removing the socket before exiting
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    write('\nqjob server: stopped')
+  finally:
+    server.server_close()
 
+subcommands={'status':status_main, 'report':report_main, 'feed':feed_main, 'workflow':workflow_main, 'server':server_main}
 
 #######################################################################################################################################
 if __name__ == "__main__":
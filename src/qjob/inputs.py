@@ -0,0 +1,76 @@
+__author__  = "Marco Mariotti"
+__email__   = "marco.mariotti@ub.edu"
+
+import io, os, re, mmap, gzip, bz2, lzma, shutil, subprocess
+from easyterm import NoTracebackError
+
+#### input files (-i, -d) may be compressed; they are decompressed while reading, without temporary files
+compressed_openers={'.gz':gzip.open, '.bz2':bz2.open, '.xz':lzma.open}
+
+def is_compressed(path):
+  """ Returns True if path is a compressed file that open_input can read, judging by its extension """
+  return os.path.splitext(path)[1] in compressed_openers or path.endswith('.zst')
+
+def open_input(path):
+  """ Opens an input file for reading as text. Files ending in .gz, .bz2, .xz or .zst are decompressed on the fly.
+  For .zst, the zstandard module is used if installed, otherwise the zstd program """
+  extension=os.path.splitext(path)[1]
+  if extension in compressed_openers:
+    return compressed_openers[extension](path, 'rt')
+  if extension=='.zst':
+    return _open_zstd(path)
+  return open(path)
+
+def _open_zstd(path):
+  """ Returns a text file handle decompressing a .zst file """
+  try:
+    import zstandard
+  except ImportError:
+    if shutil.which('zstd') is None:
+      raise NoTracebackError(f'qjob ERROR cannot read {path}: install the zstandard python module or the zstd program') from None
+    return _ZstdPipe(path)
+  return io.TextIOWrapper( zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True) )
+
+class _ZstdPipe(io.TextIOWrapper):
+  """ Text file handle reading the output of zstd -dc; the zstd process is waited for when the handle is closed.
+  If all its output was read, raises NoTracebackError if zstd failed (e.g. truncated file), with its error message """
+  def __init__(self, path):
+    self.path=path
+    self.process=subprocess.Popen(['zstd', '-dc', path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    super().__init__(self.process.stdout)
+
+  def close(self):
+    if not self.closed:
+      read_to_end=not self.buffer.peek(1)
+      super().close()
+      if not read_to_end:      # the reader stopped early (e.g. after the header): zstd would fail writing to the closed pipe
+        self.process.kill()
+      self.process.wait()
+      error=self.process.stderr.read().decode(errors='replace').strip()
+      self.process.stderr.close()
+      if read_to_end and self.process.returncode!=0:
+        raise NoTracebackError(f'qjob ERROR decompressing {self.path} with zstd: {error}')
+
+## lines which are not empty (direct mode also skips comments): matched on raw bytes, without building a string per line
+_content_line=re.compile(rb'^[ \t\f\v]*\S', re.M)
+_command_line=re.compile(rb'^[ \t\f\v]*[^\s#]', re.M)
+## bytes for which the rules above differ from those of reading text: \r is a line break in universal newlines mode, and
+## str.strip removes more whitespace (\x1c-\x1f, and non-ASCII ones such as U+00A0)
+_text_only_bytes=re.compile(rb'[\r\x1c-\x1f\x80-\xff]')
+
+def count_lines(path, skip_header=False, skip_comments=False):
+  """ Returns the number of non-empty lines of an input file, optionally skipping the first line (header) and lines
+  starting with # (comments), as they are skipped when reading the file as text. Uncompressed ASCII files without \\r are
+  memory-mapped and scanned as bytes, which is much faster than iterating over their lines """
+  if not is_compressed(path) and os.path.getsize(path)>0:
+    with open(path, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+      if _text_only_bytes.search(mm) is None:
+        pattern=_command_line if skip_comments else _content_line
+        start=mm.find(b'\n')+1 if skip_header else 0
+        if skip_header and start==0:     # only the header, with no newline
+          return 0
+        return sum(1 for _ in pattern.finditer(mm, start))
+  with open_input(path) as fh:
+    if skip_header:
+      fh.readline()
+    return sum(1 for line in fh if line.strip() and not (skip_comments and line.strip().startswith('#')))
@@ -0,0 +1,180 @@
+__author__  = "Marco Mariotti"
+__email__   = "marco.mariotti@ub.edu"
+
+import os, sqlite3, subprocess, getpass
+import xml.etree.ElementTree as ET
+
+#### the job-state database is a sqlite file stored inside the jobs folder
+db_filename='qjob.db'
+
+schema="""
+CREATE TABLE IF NOT EXISTS info (
+  key          TEXT PRIMARY KEY,
+  value        TEXT );
+CREATE TABLE IF NOT EXISTS jobs (
+  job_index    INTEGER,  -- 1-based, as in job names; for -arr arrays, the task ID
+  round        INTEGER,  -- 0 for the first run, then incremented at each run with -resume
+  name         TEXT,
+  file         TEXT,     -- job file (or job body file, with -pack)
+  submit_file  TEXT,     -- file given to qsub/sbatch; differs from file for -pack
+  task_id      INTEGER,  -- array task ID, or NULL for single jobs
+  first_line   INTEGER,  -- index of first and last command line of the workload in this job (0-based)
+  last_line    INTEGER,
+  n_lines      INTEGER,
+  sched_id     TEXT,     -- job ID returned by the scheduler
+  state        TEXT,     -- written, submitted, pending, running, error, finished (left the queue), done, failed
+  exit_status  INTEGER );
+CREATE INDEX IF NOT EXISTS jobs_submit_file ON jobs(submit_file);
+CREATE INDEX IF NOT EXISTS jobs_sched_id    ON jobs(sched_id, task_id);
+"""
+
+# states of jobs which may still change by looking at the queue
+active_states=('submitted', 'pending', 'running', 'error')
+
+
+class JobDB(object):
+  """ Job-state database of a jobs folder. Records for each job its name, files, line range, scheduler ID and state """
+  def __init__(self, folder):
+    self.folder=folder
+    self.path=os.path.join(folder, db_filename)
+    self.conn=sqlite3.connect(self.path)
+    self.conn.executescript(schema)
+
+  def close(self):
+    self.conn.close()
+
+  def set_info(self, **info):
+    """ Stores general information on the workload, e.g. sys='slurm' """
+    with self.conn:
+      self.conn.executemany('INSERT OR REPLACE INTO info(key, value) VALUES (?, ?)',
+                            [(k, str(v)) for k, v in info.items()])
+
+  def get_info(self, key, default=None):
+    row=self.conn.execute('SELECT value FROM info WHERE key=?', (key,)).fetchone()
+    return default if row is None else row[0]
+
+  def add_jobs(self, records, round=0):
+    """ Adds jobs from an iterable of tuples (job_index, name, file, submit_file, task_id, first_line, last_line, n_lines) """
+    with self.conn:
+      self.conn.executemany('INSERT INTO jobs(round, job_index, name, file, submit_file, task_id, first_line, last_line, n_lines, state) '
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'written')", [(round,)+tuple(r) for r in records])
+
+  def record_submissions(self, submissions):
+    """ Records job IDs from an iterable of tuples (submit_file, sched_id) """
+    with self.conn:
+      self.conn.executemany("UPDATE jobs SET sched_id=?, state='submitted' WHERE submit_file=?",
+                            [(sched_id, submit_file) for submit_file, sched_id in submissions])
+
+  def record_exit_status(self, results):
+    """ Records the outcome of jobs run locally, from an iterable of tuples (submit_file, task_id, exit_status).
+    task_id is None for single jobs """
+    with self.conn:
+      for submit_file, task_id, exit_status in results:
+        state='done' if exit_status==0 else 'failed'
+        if task_id is None:
+          self.conn.execute('UPDATE jobs SET state=?, exit_status=? WHERE submit_file=?', (state, exit_status, submit_file))
+        else:
+          self.conn.execute('UPDATE jobs SET state=?, exit_status=? WHERE submit_file=? AND task_id=?', (state, exit_status, submit_file, task_id))
+
+  def refresh(self, queue_states):
+    """ Updates the state of active jobs, given the dict returned by query_queue.
+    Active jobs absent from the queue are set to 'finished'. Returns the number of jobs whose state changed """
+    updates=[]
+    for rowid, sched_id, task_id, state in self.conn.execute(
+        f'SELECT rowid, sched_id, task_id, state FROM jobs WHERE state IN ({",".join("?"*len(active_states))})', active_states):
+      new_state=queue_states.get( (sched_id, task_id),
+                                  queue_states.get( (sched_id, None), 'finished') )
+      if new_state!=state:
+        updates.append( (new_state, rowid) )
+    with self.conn:
+      self.conn.executemany('UPDATE jobs SET state=? WHERE rowid=?', updates)
+    return len(updates)
+
+  def record_accounting(self, results):
+    """ Records the outcome of finished jobs from the scheduler accounting, from an iterable of tuples
+    (sched_id, task_id, state, exit_status). task_id is None for single jobs """
+    with self.conn:
+      self.conn.executemany('UPDATE jobs SET state=?, exit_status=? WHERE sched_id=? AND task_id IS ?',
+                            [(state, exit_status, sched_id, task_id) for sched_id, task_id, state, exit_status in results])
+
+  def submitted_jobs(self):
+    """ Returns the jobs submitted to the scheduler, as tuples (name, sched_id, task_id) """
+    return self.conn.execute('SELECT name, sched_id, task_id FROM jobs WHERE sched_id IS NOT NULL ORDER BY rowid').fetchall()
+
+  def state_counts(self):
+    """ Returns a list of tuples (state, number of jobs) """
+    return self.conn.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state ORDER BY state').fetchall()
+
+  def written_files(self):
+    """ Returns the files not submitted yet, in the order they were written, as tuples (submit_file, number of jobs).
+    The number of jobs is the number of tasks for array files """
+    return self.conn.execute("SELECT submit_file, COUNT(*) FROM jobs WHERE state='written' "
+                             'GROUP BY submit_file ORDER BY MIN(rowid)').fetchall()
+
+  def sched_ids(self, states=active_states):
+    """ Returns the set of scheduler IDs of jobs in the states provided """
+    return set([row[0] for row in self.conn.execute(
+      f'SELECT DISTINCT sched_id FROM jobs WHERE sched_id IS NOT NULL AND state IN ({",".join("?"*len(states))})', states)])
+
+
+def expand_task_ranges(tasks):
+  """ Returns the task IDs in a sge task specification, such as  4-10:2  or  1,3,5-6:1 """
+  task_ids=[]
+  for piece in tasks.split(','):
+    if '-' in piece:
+      start, end=piece.split('-')
+      step=1
+      if ':' in end:
+        end, step=end.split(':')
+      task_ids.extend( range(int(start), int(end)+1, int(step)) )
+    elif piece.strip():
+      task_ids.append( int(piece) )
+  return task_ids
+
+def sge_state(code):
+  """ Translates a sge state code (e.g. qw, r, Eqw) into a qjob state """
+  if 'E' in code:                   return 'error'
+  if 'r' in code or 't' in code:    return 'running'
+  if 'q' in code or 'h' in code:    return 'pending'
+  return 'running'
+
+def slurm_state(state):
+  """ Translates a slurm state (e.g. PENDING, RUNNING) into a qjob state """
+  if state in ('PENDING', 'REQUEUED', 'REQUEUE_HOLD', 'REQUEUE_FED', 'RESV_DEL_HOLD'):  return 'pending'
+  if state in ('RUNNING', 'COMPLETING', 'CONFIGURING', 'STAGE_OUT', 'SIGNALING'):      return 'running'
+  if state in ('SUSPENDED', 'STOPPED', 'RESIZING'):                                    return 'running'
+  return 'error'
+
+def query_queue(system):
+  """ Gets the state of all jobs of the current user in the queue, with a single call to qstat (sge) or squeue (slurm).
+  Returns a dict with keys (sched_id, task_id) -- task_id is None for single jobs -- and values: pending, running or error """
+  queue_states={}
+  if system=='sge':
+    p=subprocess.run(['qstat', '-xml'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if p.returncode!=0:
+      raise Exception(f'\nWhile running command= qstat -xml\nThere was ERROR= {p.stderr}')
+    for job in ET.fromstring(p.stdout).iter('job_list'):
+      sched_id=job.findtext('JB_job_number')
+      state=sge_state(job.findtext('state', ''))
+      tasks=job.findtext('tasks')
+      if tasks:
+        for task_id in expand_task_ranges(tasks):
+          queue_states[(sched_id, task_id)]=state
+      else:
+        queue_states[(sched_id, None)]=state
+
+  elif system=='slurm':
+    cmd=['squeue', '--noheader', '--array', '--user', getpass.getuser(), '--format', '%i %T']
+    p=subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if p.returncode!=0:
+      raise Exception(f'\nWhile running command= {" ".join(cmd)}\nThere was ERROR= {p.stderr}')
+    for line in p.stdout.split('\n'):
+      if not line.strip(): continue
+      job_str, state=line.split()
+      if '_' in job_str:
+        sched_id, tasks=job_str.split('_', 1)
+        for task_id in expand_task_ranges(tasks.strip('[]').split('%')[0]):
+          queue_states[(sched_id, task_id)]=slurm_state(state)
+      else:
+        queue_states[(job_str, None)]=slurm_state(state)
+  return queue_states
@@ -0,0 +1,75 @@
+__author__  = "Marco Mariotti"
+__email__   = "marco.mariotti@ub.edu"
+
+import os, subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+#### job files for the local system carry their settings in lines like:  #QJOB -o logfile
+directive_prefix='#QJOB '
+
+class LocalTaskResult(object):
+  """ Outcome of running a job file (or one task of an array job file) on the local machine """
+  def __init__(self, outfile, task_id=None):
+    self.outfile=outfile
+    self.task_id=task_id     # None for single jobs
+    self.exit_status=None
+
+  def __repr__(self):
+    return f'LocalTaskResult(outfile={self.outfile}, task_id={self.task_id}, exit_status={self.exit_status})'
+
+
+def read_directives(outfile):
+  """ Reads the #QJOB lines at the top of a job file; returns a dict like {'-o':'logfile', '-c':'2'} """
+  directives={}
+  with open(outfile) as fh:
+    for line in fh:
+      if line.startswith(directive_prefix):
+        key, _, value=line[len(directive_prefix):].strip().partition(' ')
+        directives[key]=value.strip()
+      elif not line.startswith('#'):
+        break
+  return directives
+
+def parse_range(range_str):
+  """ Returns the task IDs of an array range, e.g. 1-10 or 1-10:2 """
+  start, end=range_str.split('-')
+  step=1
+  if ':' in end:
+    end, step=end.split(':')
+  return range(int(start), int(end)+1, int(step))
+
+def local_tasks(outfile):
+  """ Returns the list of tasks of a job file, as tuples (outfile, task_id, directives); task_id is None for single jobs """
+  directives=read_directives(outfile)
+  if '-a' in directives:
+    return [(outfile, task_id, directives) for task_id in parse_range(directives['-a'])]
+  return [(outfile, None, directives)]
+
+def run_task(outfile, task_id, directives):
+  """ Runs a job file (or one of its tasks) with bash, in the current directory.
+  Standard output and error are appended to the log files in its directives """
+  result=LocalTaskResult(outfile, task_id)
+  env=dict(os.environ)
+  env['NSLOTS']=directives.get('-c', '1')
+  task_str=''
+  if not task_id is None:
+    task_str=str(task_id)
+    env['SGE_TASK_ID']=env['SLURM_ARRAY_TASK_ID']=task_str
+  logout=directives.get('-o', outfile+'.LOG').replace('$TASK_ID', task_str)
+  logerr=directives.get('-e', outfile+'.ERR').replace('$TASK_ID', task_str)
+  with open(logout, 'a') as out_fh:
+    if logerr==logout:
+      result.exit_status=subprocess.call(['bash', outfile], stdout=out_fh, stderr=subprocess.STDOUT, env=env)
+    else:
+      with open(logerr, 'a') as err_fh:
+        result.exit_status=subprocess.call(['bash', outfile], stdout=out_fh, stderr=err_fh, env=env)
+  return result
+
+def run_local_jobs(outfiles, workers=1):
+  """ Runs job files on the local machine, with at most workers jobs (or array tasks) running at the same time.
+  Yields a LocalTaskResult for each job or task, as they complete """
+  tasks=[task  for outfile in outfiles  for task in local_tasks(outfile)]
+  with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+    futures=[executor.submit(run_task, *task) for task in tasks]
+    for future in as_completed(futures):
+      yield future.result()
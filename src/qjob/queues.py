@@ -0,0 +1,96 @@
+__author__  = "Marco Mariotti"
+__email__   = "marco.mariotti@ub.edu"
+
+import subprocess
+import xml.etree.ElementTree as ET
+from .jobdb import expand_task_ranges
+
+#### with option -qload, jobs are spread over several queues (or partitions) according to a snapshot of their load
+
+class QueueLoad(object):
+  """ Load of a queue (sge) or partition (slurm), in processors (slots): in use, free, total, and requested by pending jobs """
+  def __init__(self, name, used=0, free=0, total=0, pending=0):
+    self.name=name
+    self.used=used
+    self.free=free
+    self.total=total
+    self.pending=pending
+
+  def __repr__(self):
+    return f'QueueLoad(name={self.name}, used={self.used}, free={self.free}, total={self.total}, pending={self.pending})'
+
+def run_query(cmd):
+  """ Runs a scheduler query command; returns its standard output """
+  p=subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+  if p.returncode!=0:
+    raise Exception(f'\nWhile running command= {" ".join(cmd)}\nThere was ERROR= {p.stderr}')
+  return p.stdout
+
+def query_queue_loads(system, queues):
+  """ Gets the load of queues (sge) or partitions (slurm): processors in use, free and in total, with a single call to
+  qstat -g c or sinfo, and processors requested by pending jobs, with a single call to qstat or squeue.
+  Returns a dict: queue name -> QueueLoad. Queues unknown to the scheduler are not included """
+  loads={}
+  if system=='slurm':
+    for line in run_query(['sinfo', '--noheader', '--partition', ','.join(queues), '--format', '%R|%C']).split('\n'):
+      if not line.strip(): continue
+      name, cpus=line.split('|')
+      allocated, idle, other, total=[int(x) for x in cpus.split('/')]
+      load=loads.setdefault(name, QueueLoad(name))
+      load.used+=allocated
+      load.free+=idle
+      load.total+=total
+    for line in run_query(['squeue', '--noheader', '--states', 'PENDING', '--array', '--partition', ','.join(queues),
+                           '--format', '%P|%C']).split('\n'):
+      if not line.strip(): continue
+      names, cpus=line.split('|')
+      for name in names.split(','):    # jobs pending on several partitions count on each
+        if name in loads:
+          loads[name].pending+=int(cpus)
+
+  elif system=='sge':
+    for line in run_query(['qstat', '-g', 'c']).split('\n'):
+      s=line.split()
+      if len(s)<6 or not s[0] in queues: continue      # header, separator, other queues
+      name, used, available, total=s[0], int(s[2]), int(s[4]), int(s[5])
+      loads[name]=QueueLoad(name, used=used, free=available, total=total)
+    for job in ET.fromstring( run_query(['qstat', '-u', '*', '-s', 'p', '-r', '-xml']) ).iter('job_list'):
+      requested=[q.text.split('@')[0]  for q in job.iter('hard_req_queue')  if q.text]
+      slots=int(job.findtext('slots', '1'))
+      tasks=job.findtext('tasks')
+      if tasks:
+        slots*=len(expand_task_ranges(tasks))
+      for name in requested:     # jobs not requesting a queue may run in any: they are not counted
+        if name in loads:
+          loads[name].pending+=slots
+  return loads
+
+class QueueBalancer(object):
+  """ Assigns jobs to queues, each time choosing the one where a job would wait less: the one with the lowest
+  demand (processors requested by pending jobs, and by jobs assigned so far) in excess of its free processors, relative to
+  its size. Ties are broken in favour of queues with more free processors, then by the order of queues.
+
+  Parameters
+  ----------
+  loads : dict
+      queue name -> QueueLoad, as returned by query_queue_loads
+  queues : list
+      candidate queue names, in order of preference
+  """
+  def __init__(self, loads, queues):
+    self.loads=loads
+    self.queues=[q for q in queues if q in loads and loads[q].total>0]
+    if not self.queues:
+      raise ValueError(f'no usable queues among: {",".join(queues)}')
+    self.assigned={q:0 for q in self.queues}    # processors assigned to each queue
+
+  def expected_wait(self, queue, slots):
+    """ Returns a score proportional to the expected wait of a job requesting slots processors in queue """
+    load=self.loads[queue]
+    return max(0, load.pending + self.assigned[queue] + slots - load.free) / load.total
+
+  def assign(self, slots=1):
+    """ Returns the queue to which a job requesting slots processors is assigned, and records it """
+    queue=min(self.queues, key=lambda q: (self.expected_wait(q, slots), -(self.loads[q].free-self.assigned[q]), self.queues.index(q)))
+    self.assigned[queue]+=slots
+    return queue
@@ -0,0 +1,276 @@
+__author__  = "Marco Mariotti"
+__email__   = "marco.mariotti@ub.edu"
+
+from easyterm import NoTracebackError
+
+#### templates:
+sge_header_template="""#!/bin/bash
+#$ -S /bin/bash
+#$ -cwd
+#$ -M {email} {queue_line}{time_line}{additional_options}
+#$ -N {name}{mem}{cpus} 
+"""
+sge_header_single_job=sge_header_template+"""#$ -e {logerr}
+#$ -o {logout}
+"""
+sge_header_array_job=sge_header_template+"""#$ -e {logerr}
+#$ -o {logout}
+#$ -t {range_str}
+"""
+
+sge_pe_template=  "\n#$ -pe {pe} {procs}"   ## for n of processors
+slurm_pe_template="\n#SBATCH -c {procs}"   
+
+slurm_header_template="""#!/bin/bash       
+#SBATCH -J {name} {queue_line}{time_line}{additional_options}{mem}{cpus}
+#SBATCH --mail-user={email}
+"""
+
+slurm_header_single_job=slurm_header_template+"""#SBATCH -e {logerr}
+#SBATCH -o {logout}
+"""
+slurm_header_array_job= slurm_header_template+"""#SBATCH -e {logerr}
+#SBATCH -o {logout}
+#SBATCH -a {range_str}
+"""
+
+local_pe_template="\n#QJOB -c {procs}"
+local_header_template="""#!/bin/bash
+#QJOB -N {name}{cpus}
+"""
+local_header_single_job=local_header_template+"""#QJOB -e {logerr}
+#QJOB -o {logout}
+"""
+local_header_array_job=local_header_template+"""#QJOB -e {logerr}
+#QJOB -o {logout}
+#QJOB -a {range_str}
+"""
+
+## with option -par, the command lines of a job are run in parallel through this bash code
+parallel_runner_template="""qjob_workers={workers}
+qjob_tmp=$(mktemp -d)
+trap 'rm -rf "$qjob_tmp"' EXIT
+qjob_run() {{  # runs command n.$1 in background, as soon as a worker is free; its exit status is stored in $qjob_tmp/$1
+  while [ "$(jobs -rp | wc -l)" -ge "$qjob_workers" ]; do wait -n; done
+  {{ ( qjob_cmd_$1 ); echo $? > "$qjob_tmp/$1"; }} &
+}}
+{functions}{runs}wait
+qjob_failed=0
+{lines}for qjob_i in $(seq 1 {n}); do
+  qjob_status=$(cat "$qjob_tmp/$qjob_i" 2>/dev/null || echo unknown)
+{record}  if [ "$qjob_status" != 0 ]; then echo "qjob: command n.$qjob_i failed with exit status $qjob_status" >&2; qjob_failed=1; fi
+done
+"""
+
+## with option -index, an array task fetches the commands of its job from the commands file, at the byte offsets read from the
+## index file. This has a fixed-width line per job with its start offset, plus a last line with the end offset, so that task N
+## reads only lines N and N+1; tail -c seeks in regular files, so this takes the same time whatever the number of jobs
+index_width=16    # bytes per line of the index file, newline included
+index_dispatch_template="""# commands: {cmds_file}  sha1: {digest}
+qjob_task={task_id_var}
+{{ read qjob_start; read qjob_end; }} < <(tail -c +$(( (qjob_task-1)*{width}+1 )) "{idx_file}" | head -c {two_lines})
+if [ -z "$qjob_end" ]; then echo "qjob: no commands for task $qjob_task in {cmds_file}" >&2; exit 1; fi
+eval "$(tail -c +$(( qjob_start+1 )) "{cmds_file}" | head -c $(( qjob_end-qjob_start )))"
+"""
+
+class JobScript(object):
+  """Builds the text of job files for a set of qjob options (a dict like qjob.cli.def_opt): the scheduler header, with
+  queue, time limit, memory, processors, email and logs, and the body, with the command lines of the job.
+
+  Parameters
+  ----------
+  opt : dict
+      qjob options
+  dependency_ids : list
+      scheduler IDs of jobs that must complete successfully before these jobs start (option -after)
+  """
+  def __init__(self, opt, dependency_ids=[]):
+    self.opt=opt
+
+    ## header/footer commands
+    self.init_command=''
+    if opt['bin']:
+      self.init_command += 'export PATH='+opt['bin']+':$PATH\n'
+    if opt['head']:
+      self.init_command += '\n'.join([ line.strip() for line in open(opt['head']) ])  # adding header lines
+    self.footer_command=''  if not opt['foot'] else (
+      '\n'.join([ line.strip() for line in open(opt['foot']) ]) + '\n' )  # adding footer lines
+
+    ## reading custom synonyms
+    queue_synonyms={}
+    if opt['qsyn']:
+      for assign_piece in opt['qsyn'].split(';'):
+        syn_name, queue =assign_piece.split('=') #queue can be comma separated but we pass it as it is
+        queue_synonyms[syn_name]=queue
+    pe_table={}
+    if opt['peq']:
+      for assign_piece in opt['peq'].split(';'):
+        queue, pe =assign_piece.split('=') 
+        pe_table[queue]=pe
+
+    ## determining queue
+    self.queue_name=opt['q'] if not opt['q'] in queue_synonyms else queue_synonyms[opt['q']]
+
+    ## time limit
+    time_limit_minutes=None
+    if opt['t'] and opt['t']!='0':  
+      if   str(opt['t']).endswith('m'):       time_limit_minutes=int(opt['t'][:-1])  
+      elif str(opt['t']).endswith('d'):       time_limit_minutes=int(opt['t'][:-1])*60*24
+      elif str(opt['t']).endswith('h'):       time_limit_minutes=int(opt['t'][:-1])*60
+      else:                                   time_limit_minutes=int(opt['t'])*60
+
+    self.time_limit_minutes=time_limit_minutes
+
+    ## remaining lines to be put in job
+    queue_name=self.queue_name
+    additional_options=''
+    if   opt['sys']=='sge':
+      ## queue or partition
+      queue_line= "\n#$ -q {}".format(queue_name) if (queue_name and queue_name!='0') else ''
+      ## time constraint
+      time_line='\n#$ -l h_rt={h}:{m}:00'.format(h=time_limit_minutes//60, m=time_limit_minutes%60)  if not time_limit_minutes is None else ''
+      ## email
+      if opt['E']:          additional_options+='\n#$ -m {} '.format(opt['E']  if not opt['E']=='v' else 'abes')
+      ## environmental vars
+      if not opt['e']:      additional_options+='\n#$ -V '
+      ## memory
+      mem_specs='\n#$ -l virtual_free={m}G'.format(m=opt['m']) if opt['m'] else ''
+      ## cpus
+      parallelization=opt['pe']    if not queue_name in pe_table else pe_table[queue_name]
+      cpu_specs=sge_pe_template.format(procs=opt['p'], pe=parallelization)     if opt['p'] else ''
+      ## dependencies (-after)
+      if dependency_ids:
+        additional_options+=( '\n#$ -hold_jid_ad {}'.format(dependency_ids[0])  if opt['aftercorr'] else
+                              '\n#$ -hold_jid {}'.format(','.join(dependency_ids)) )
+     
+    elif opt['sys']=='slurm':
+      ## queue or partition
+      queue_line= "\n#SBATCH -p {}".format(queue_name) if (queue_name and queue_name!='0')else ''
+      ## time constraint
+      time_line=  '\n#SBATCH -t 0-{h}:{m}'.format(h=time_limit_minutes//60, m=time_limit_minutes%60)  if not time_limit_minutes is None else ''
+      ## email
+      if opt['E']:          
+        sge_mail_codes2slurm_code={'a':'FAIL', 'b':'BEGIN', 'e':'END', 'v':'ALL'}
+        for code in opt['E']: 
+          if not code in sge_mail_codes2slurm_code: raise NoTracebackError("ERROR this -E option is not valid for slurm: {}".format(code))
+          additional_options+='\n#SBATCH --mail-type={}'.format(sge_mail_codes2slurm_code[code])
+      ## environmental vars
+      if not opt['e']:        additional_options+='\n#SBATCH --export ALL'
+      ## memory
+      mem_specs='\n#SBATCH --mem={m}G'.format(m=opt['m']) if opt['m'] else ''
+      ## cpus
+      cpu_specs=slurm_pe_template.format(procs=opt['p']) if opt['p'] else ''
+      if opt['qos']:
+        additional_options+="\n#SBATCH -q {}".format(opt['qos'])
+      ## dependencies (-after)
+      if dependency_ids:
+        additional_options+=( '\n#SBATCH --dependency=aftercorr:{}'.format(dependency_ids[0])  if opt['aftercorr'] else
+                              '\n#SBATCH --dependency=afterok:{}'.format(':'.join(dependency_ids)) )
+        additional_options+='\n#SBATCH --kill-on-invalid-dep=yes'   # otherwise jobs stay pending forever if a dependency fails
+
+    elif opt['sys']=='local':
+      ## queue, time, memory, email are not used when running locally
+      queue_line, time_line, mem_specs='', '', ''
+      ## cpus, exported to jobs as $NSLOTS
+      cpu_specs=local_pe_template.format(procs=opt['p']) if opt['p'] else ''
+
+    else:
+      raise NoTracebackError('qjob ERROR -sys  must be one of  sge, slurm, local')
+
+    self.queue_line, self.time_line, self.mem_specs, self.cpu_specs=queue_line, time_line, mem_specs, cpu_specs
+    self.additional_options=additional_options
+    
+    ## easy handled options:
+    self.suffix_out='LOG'
+    self.suffix_err='ERR' if not opt['joe'] else 'LOG'
+    self.task_id_var='$SLURM_ARRAY_TASK_ID' if opt['sys']=='slurm' else '$SGE_TASK_ID'
+
+  def header(self, name, outfile, logout, logerr, range_str=None, append=False):
+    """ Returns the scheduler header of a job file; an array job header is produced if range_str is provided.
+    If append is True, logs are opened in append mode (always the case with -sl)"""
+    opt=self.opt
+    if   opt['sys']=='sge':
+      header_template=sge_header_single_job if range_str is None else sge_header_array_job
+      header_add_options=self.additional_options
+    elif opt['sys']=='slurm':
+      header_template=slurm_header_single_job if range_str is None else slurm_header_array_job
+      header_add_options=self.additional_options + ('\n#SBATCH --open-mode=append'  if (opt['sl'] or append) else '')
+    elif opt['sys']=='local':
+      header_template=local_header_single_job if range_str is None else local_header_array_job
+      header_add_options=''
+    return header_template.format(email=opt['email'],
+                                  additional_options=header_add_options,
+                                  queue_line=self.queue_line,
+                                  time_line=self.time_line,
+                                  name=name,
+                                  outfile=outfile,
+                                  cpus=self.cpu_specs,
+                                  mem=self.mem_specs,
+                                  logout=logout,
+                                  logerr=logerr,
+                                  range_str=range_str)
+
+  def srun_commands(self, job_commands):
+    """ Returns job_commands with each line prefixed by srun, if requested (option -srun, with slurm) """
+    opt=self.opt
+    if opt['sys']=='slurm' and opt['srun']:
+      srun_prefix='srun '  if not opt['par'] else 'srun --exclusive -N 1 -n 1 -c 1 '   # job steps running side by side
+      job_commands=[ '\n'.join( [srun_prefix+i.strip()  for i in cmd.split('\n') if i.strip()] )   for cmd in job_commands ]
+    return job_commands
+
+  def commands(self, job_commands, line_indices=None, status_file=None):
+    """ Returns the text of job_commands to be run one after the other, without header and footer commands. 
+    With option -track (or -resume), the exit status of each command is appended to status_file, with its index in line_indices,
+    and variable qjob_failed is set to 1 if any command failed: the job must end with  exit $qjob_failed  (see tracked_exit) """
+    opt=self.opt
+    job_commands=self.srun_commands(job_commands)
+    if (opt['track'] or opt['resume']) and not status_file is None:
+      job_commands=['qjob_failed=0'] + [
+        f'{cmd.rstrip()}\nqjob_rc=$?; echo "{line_index} $qjob_rc" >> "{status_file}"; [ $qjob_rc = 0 ] || qjob_failed=1'
+        for line_index, cmd in zip(line_indices, job_commands) ]
+    return '\n'.join(job_commands).rstrip('\n')+'\n'
+
+  def tracked_exit(self, status_file=None):
+    """ Returns the last command of a job with option -track (or -resume), so that it fails if any of its commands failed,
+    although the last command is the one recording an exit status. Returns an empty string otherwise """
+    opt=self.opt
+    return 'exit $qjob_failed\n'  if ((opt['track'] or opt['resume']) and not status_file is None) else  ''
+
+  def body(self, job_commands, line_indices=None, status_file=None):
+    """ Returns the commands executed by a job: header commands, job_commands (prefixed by srun if requested), footer commands.
+    With option -par, job_commands are run in parallel by the bash runner defined in parallel_runner_template.
+    With option -track (or -resume), the exit status of each command is appended to status_file, with its index in line_indices """
+    opt=self.opt
+    init_command, footer_command=self.init_command, self.footer_command
+    track=(opt['track'] or opt['resume']) and not status_file is None
+    if not opt['par']:
+      return (init_command.rstrip('\n') + '\n' +
+              self.commands(job_commands, line_indices, status_file=status_file) +
+              footer_command +
+              self.tracked_exit(status_file))
+    job_commands=self.srun_commands(job_commands)
+
+    workers_var='${{NSLOTS:-${{SLURM_CPUS_PER_TASK:-{p}}}}}' if opt['sys']!='slurm' else '${{SLURM_CPUS_PER_TASK:-${{NSLOTS:-{p}}}}}'
+    return (init_command.rstrip('\n') + '\n' +
+            parallel_runner_template.format(
+              workers=workers_var.format(p=opt['p'] if opt['p'] else 1),
+              n=len(job_commands),
+              functions=''.join( [f'qjob_cmd_{i}() {{\n{cmd.rstrip()}\n}}\n'  for i, cmd in enumerate(job_commands, 1)] ),
+              runs=''.join( [f'qjob_run {i}\n'  for i in range(1, len(job_commands)+1)] ),
+              record='' if not track else (
+                f'  echo "${{qjob_lines[$qjob_i]}} $qjob_status" >> "{status_file}"\n' ),
+              lines='' if not track else (
+                f'qjob_lines=(_ {" ".join([str(i) for i in line_indices])})\n' ) ) +
+            footer_command +
+            'exit $qjob_failed\n')
+
+  def index_body(self, cmds_file, idx_file, digest, status_file=None):
+    """ Returns the commands executed by an array task with option -index: header commands, the commands of the job with
+    the task ID as index, read from cmds_file and idx_file (see index_dispatch_template), footer commands.
+    digest is the hash of cmds_file, written in a comment so that the job file changes whenever commands do.
+    status_file is the one given to commands when writing cmds_file, if any """
+    return (self.init_command.rstrip('\n') + '\n' +
+            index_dispatch_template.format(cmds_file=cmds_file, idx_file=idx_file, digest=digest, task_id_var=self.task_id_var,
+                                           width=index_width, two_lines=2*index_width) +
+            self.footer_command +
+            self.tracked_exit(status_file))
@@ -0,0 +1,134 @@
+__author__  = "Marco Mariotti"
+__email__   = "marco.mariotti@ub.edu"
+
+import os, socket, socketserver, threading, json, queue
+from collections import deque
+from .submission import SubmissionResult, submission_command, submit_file
+
+#### the submission server listens on a unix socket; messages are lines of JSON.
+# Request:   {"client": "user:pid", "system": "slurm", "submit_options": "", "files": ["/path/job.1", ...]}
+# Replies:   one line per file as its submission completes:  {"outfile": ..., "job_id": ..., "error": ..., "attempts": ..., "latencies": [...]}
+#            then a last line:  {"done": true}
+default_socket_path=os.path.join(os.path.expanduser('~'), '.qjob.sock')
+
+
+class SubmissionRequest(object):
+  """ Job files sent by a client in one connection; results are put in the replies queue as they are ready """
+  def __init__(self, client, system, submit_options, files):
+    self.client=client
+    self.system=system
+    self.submit_options=submit_options
+    self.pending=deque(files)
+    self.replies=queue.Queue()
+    self.stop=threading.Event()    # set after a non-transient failure: files not yet submitted are not attempted
+
+
+class SubmissionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  """ Long-lived server receiving job files to submit from many qjob clients at once. A single pool of workers submits
+  them, taking files from clients in turn (round robin), so that a client sending many files does not delay the others """
+  daemon_threads=True
+
+  def __init__(self, socket_path=default_socket_path, workers=8, max_attempts=5, backoff=1.0):
+    self.socket_path=socket_path
+    self.max_attempts=max_attempts
+    self.backoff=backoff
+    self.requests=deque()          # requests with files not yet taken by workers, in turn order
+    self.condition=threading.Condition()
+    if os.path.exists(socket_path):
+      if server_is_running(socket_path):
+        raise OSError(f'a qjob server is already listening on {socket_path}')
+      os.remove(socket_path)       # left by a server which did not exit cleanly
+    old_umask=os.umask(0o177)      # socket accessible only by its owner
+    try:
+      super().__init__(socket_path, SubmissionHandler)
+    finally:
+      os.umask(old_umask)
+    for _ in range(max(1, workers)):
+      threading.Thread(target=self.work, daemon=True).start()
+
+  def add(self, request):
+    with self.condition:
+      self.requests.append(request)
+      self.condition.notify_all()
+
+  def next_file(self):
+    """ Waits for a file to submit; returns the request it belongs to, and the file. Requests take turns """
+    with self.condition:
+      while not self.requests:
+        self.condition.wait()
+      request=self.requests.popleft()
+      outfile=request.pending.popleft()
+      if request.pending:
+        self.requests.append(request)   # back in line, after the other clients
+      return request, outfile
+
+  def work(self):
+    while True:
+      request, outfile=self.next_file()
+      result=SubmissionResult(outfile)
+      try:
+        if request.stop.is_set():
+          result.error='not attempted, since a previous submission failed'
+        else:
+          submit_file( submission_command(request.system, outfile, request.submit_options), result,
+                       max_attempts=self.max_attempts, backoff=self.backoff )
+          if result.job_id is None:
+            request.stop.set()
+      except Exception as e:     # e.g. invalid submit options or system: the worker must survive, and the client get the error
+        result.job_id, result.error, result.attempts= None, f'{type(e).__name__}: {e}', max(1, result.attempts)
+        request.stop.set()
+      request.replies.put(result)
+
+  def server_close(self):
+    super().server_close()
+    if os.path.exists(self.socket_path):
+      os.remove(self.socket_path)
+
+
+class SubmissionHandler(socketserver.StreamRequestHandler):
+  """ Handles the connection of a client: reads its request, then sends back results as they complete """
+  def handle(self):
+    line=self.rfile.readline()
+    if not line.strip():
+      return     # e.g. server_is_running checking the connection
+    message=json.loads(line)
+    files=message['files']
+    request=SubmissionRequest(message.get('client', ''), message['system'], message.get('submit_options', ''), files)
+    if files:
+      self.server.add(request)
+    for _ in range(len(files)):
+      result=request.replies.get()
+      self.wfile.write( (json.dumps({'outfile':result.outfile, 'job_id':result.job_id, 'error':result.error,
+                                     'attempts':result.attempts, 'latencies':result.latencies}) + '\n').encode() )
+    self.wfile.write(b'{"done": true}\n')
+
+
+def server_is_running(socket_path=default_socket_path):
+  """ Tells whether a qjob server is listening on socket_path """
+  if not os.path.exists(socket_path):
+    return False
+  s=socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    s.connect(socket_path)
+    return True
+  except OSError:
+    return False
+  finally:
+    s.close()
+
+def submit_via_server(outfiles, system, submit_options='', socket_path=default_socket_path):
+  """ Sends job files to the qjob server listening on socket_path. Yields a SubmissionResult for each file, as they complete,
+  like submission.submit_jobs """
+  with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+    s.connect(socket_path)
+    s.sendall( (json.dumps({'client':f'{os.getuid()}:{os.getpid()}', 'system':system,
+                            'submit_options':submit_options, 'files':list(outfiles)}) + '\n').encode() )
+    with s.makefile('r') as fh:
+      for line in fh:
+        reply=json.loads(line)
+        if reply.get('done'):
+          return
+        result=SubmissionResult(reply['outfile'])
+        result.job_id, result.error, result.attempts, result.latencies=reply['job_id'], reply['error'], reply['attempts'], reply['latencies']
+        yield result
+  raise ConnectionError(f'the qjob server on {socket_path} closed the connection before all results were received')
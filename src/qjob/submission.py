@@ -0,0 +1,99 @@
+__author__  = "Marco Mariotti"
+__email__   = "marco.mariotti@ub.edu"
+
+import subprocess, shlex, time, random, re, threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+#### error messages of qsub/sbatch which indicate a temporary problem of the scheduler; submission is retried
+transient_error_patterns=[
+  # slurm
+  'socket timed out', 'unable to contact slurm controller', 'resource temporarily unavailable',
+  'zero bytes were transmitted', 'slurm_persist_conn', 'connection refused', 'try again',
+  # sge
+  'unable to contact qmaster', 'failed receiving gdi request', 'unable to send message to qmaster',
+  'commlib error', 'got no connection within', 'timeout' ]
+transient_error_rx=re.compile( '|'.join([re.escape(p) for p in transient_error_patterns]), re.IGNORECASE)
+
+
+class SubmissionResult(object):
+  """ Outcome of the submission of a single job file """
+  def __init__(self, outfile):
+    self.outfile=outfile
+    self.job_id=None      # scheduler job ID, if submitted
+    self.error=None       # last error message, if not submitted
+    self.attempts=0       # number of qsub/sbatch calls
+    self.latencies=[]     # seconds taken by each qsub/sbatch call
+
+  def __repr__(self):
+    return f'SubmissionResult(outfile={self.outfile}, job_id={self.job_id}, error={self.error}, attempts={self.attempts})'
+
+
+def submission_command(system, outfile, submit_add_options=''):
+  """ Returns the command to submit a job file, set to print only the job ID """
+  if   system=='sge':
+    return f'qsub -terse {submit_add_options} {outfile}'
+  elif system=='slurm':
+    return f'sbatch --parsable {submit_add_options} {outfile}'
+  raise ValueError(f'submission_command ERROR unknown system: {system}')
+
+def parse_job_id(output):
+  """ Gets the job ID from the output of qsub -terse or sbatch --parsable.
+  Array jobs in sge are reported like 123.1-10:1, while slurm may add a cluster name like 123;cluster """
+  lines=[line.strip() for line in output.split('\n') if line.strip()]
+  if not lines: return None
+  return lines[-1].split(';')[0].split('.')[0]
+
+def is_transient_error(message):
+  """ Tells whether the output of a failed submission is caused by a temporary problem of the scheduler """
+  return bool(transient_error_rx.search(message))
+
+def submit_file(cmd, result, max_attempts=5, backoff=1.0, max_backoff=60.0):
+  """ Runs the submission command cmd, retrying with exponential backoff on transient errors.
+  The SubmissionResult instance provided is filled and returned """
+  while True:
+    result.attempts+=1
+    start=time.perf_counter()
+    try:
+      p=subprocess.run(shlex.split(cmd),
+                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                       text=True)
+      returncode, output=p.returncode, p.stdout
+    except OSError as e:
+      returncode, output= -1, str(e)
+    result.latencies.append(time.perf_counter()-start)
+
+    if returncode==0:
+      result.job_id=parse_job_id(output) or ''
+      result.error=None
+      return result
+    result.error=output.strip()
+    if result.attempts>=max_attempts or not is_transient_error(output):
+      return result
+    # exponential backoff with jitter, so that workers do not retry all at once
+    delay=min(max_backoff, backoff * 2**(result.attempts-1))
+    time.sleep( delay * (0.5 + random.random()/2) )
+
+def submit_jobs(outfiles, system, submit_add_options='', workers=8, max_attempts=5, backoff=1.0):
+  """ Submits job files concurrently using a pool of workers. Yields a SubmissionResult for each file, as they complete.
+  When a submission fails for a non-transient error (e.g. invalid options), the files not yet submitted are not attempted:
+  their SubmissionResult has error set and attempts=0 """
+  stop=threading.Event()
+
+  def work(outfile):
+    result=SubmissionResult(outfile)
+    if stop.is_set():
+      result.error='not attempted, since a previous submission failed'
+      return result
+    try:
+      submit_file( submission_command(system, outfile, submit_add_options), result,
+                   max_attempts=max_attempts, backoff=backoff )
+    except Exception as e:     # e.g. invalid submit options: reported as a failed submission, like scheduler errors
+      result.job_id, result.error, result.attempts= None, f'{type(e).__name__}: {e}', max(1, result.attempts)
+    if result.job_id is None:
+      stop.set()
+    return result
+
+  with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+    futures=[executor.submit(work, outfile) for outfile in outfiles]
+    for future in as_completed(futures):
+      yield future.result()
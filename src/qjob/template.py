@@ -0,0 +1,77 @@
+__author__  = "Marco Mariotti"
+__email__   = "marco.mariotti@ub.edu"
+
+import string
+from operator import itemgetter
+
+conversion_functions={'s':str, 'r':repr, 'a':ascii}
+
+def compile_template(template, fields):
+  """Parses a template (with placeholders enclosed in {}, as in str.format) once, and returns a function to render it.
+
+  The returned function takes a row, i.e. a list of values ordered as fields, and returns the same string as
+  template.format(**dict(zip(fields, row))), without building a dict for each row.
+  Templates using attributes or indexes of fields (e.g. {x.y} or {x[0]}), or nested placeholders in format
+  specifications, are rendered with str.format instead.
+
+  Parameters
+  ----------
+  template : str
+      template text
+  fields : list
+      names of the columns of data rows
+
+  Returns
+  -------
+  function
+      function taking a row (list of str) and returning the rendered template
+  """
+  column_index={f:fi for fi, f in enumerate(fields)}
+  pieces=[]        # text given to the % operator
+  indexes=[]       # for each placeholder, the column index of its field
+  converters=[]    # for each placeholder, None or a function applying conversion and format spec
+  for literal, field_name, format_spec, conversion in string.Formatter().parse(template):
+    pieces.append(literal.replace('%', '%%'))
+    if field_name is None:
+      continue
+    if (not field_name in column_index or
+        '{' in format_spec):
+      return _slow_renderer(template, fields)
+    pieces.append('%s')
+    indexes.append(column_index[field_name])
+    converters.append( _converter(conversion, format_spec) )
+  fmt=''.join(pieces)
+
+  if not indexes:
+    constant= fmt % ()
+    return lambda row: constant
+
+  if all(c is None for c in converters):
+    # fast path: plain substitutions
+    if len(indexes)==1:
+      index=indexes[0]
+      return lambda row: fmt % (row[index],)
+    getter=itemgetter(*indexes)
+    return lambda row: fmt % getter(row)
+
+  index_and_converters=list(zip(indexes, converters))
+  def render(row):
+    return fmt % tuple([ (row[i] if c is None else c(row[i]))  for i, c in index_and_converters ])
+  return render
+
+def _converter(conversion, format_spec):
+  """Returns None if the placeholder needs no conversion nor format spec, or a function that applies them """
+  if not conversion and not format_spec:
+    return None
+  if conversion and not conversion in conversion_functions:
+    raise ValueError(f"Unknown conversion specifier {conversion}")
+  conversion_function=conversion_functions[conversion] if conversion else None
+  def convert(value):
+    if not conversion_function is None:
+      value=conversion_function(value)
+    return format(value, format_spec)
+  return convert
+
+def _slow_renderer(template, fields):
+  """Returns a function rendering template with str.format, building a dict for each row """
+  return lambda row: template.format( **dict(zip(fields, row)) )
@@ -0,0 +1,83 @@
+__author__  = "Marco Mariotti"
+__email__   = "marco.mariotti@ub.edu"
+
+import os, time, hashlib
+from concurrent.futures import ThreadPoolExecutor
+from more_itertools import chunked
+
+#### a command line is up to date if all its output files exist and are newer than its input files, as in make.
+#### With content hashes, inputs are compared with their hash recorded when the line was last put in a job instead
+
+hashes_filename='input_hashes.tsv'
+
+def read_hashes(folder):
+  """ Reads the input hashes recorded in a jobs folder. Returns a dict: key of a command line (its output files, tab separated)
+  -> tuple (sha1 of its input files, time when it was recorded) """
+  hashes={}
+  path=os.path.join(folder, hashes_filename)
+  if os.path.isfile(path):
+    with open(path) as fh:
+      for line in fh:
+        *outputs, digest, recorded=line.rstrip('\n').split('\t')
+        hashes['\t'.join(outputs)]=(digest, float(recorded))
+  return hashes
+
+def write_hashes(folder, hashes):
+  """ Writes the input hashes of command lines in a jobs folder, given a dict like the one returned by read_hashes """
+  path=os.path.join(folder, hashes_filename)
+  with open(path+'.tmp', 'w') as ofh:
+    for key, (digest, recorded) in hashes.items():
+      ofh.write(f'{key}\t{digest}\t{recorded}\n')
+  os.replace(path+'.tmp', path)
+
+def mtime(path):
+  """ Returns the modification time of a file, or None if it does not exist """
+  try:
+    return os.stat(path).st_mtime
+  except OSError:
+    return None
+
+def files_digest(paths):
+  """ Returns the sha1 of the content of files, or None if any is missing """
+  sha1=hashlib.sha1()
+  for path in paths:
+    try:
+      with open(path, 'rb') as fh:
+        for block in iter(lambda : fh.read(1<<20), b''):
+          sha1.update(block)
+    except OSError:
+      return None
+  return sha1.hexdigest()
+
+def check_line(outputs, inputs, hashes=None):
+  """ Checks whether a command line is up to date (never if it has no outputs). Returns a tuple (is_up_to_date, digest);
+  digest is the hash of its inputs if hashes (a dict as returned by read_hashes) is provided, None otherwise """
+  output_times=[mtime(path) for path in outputs]
+  digest=None  if hashes is None else  files_digest(inputs)
+  if not outputs or None in output_times:     # a line without declared outputs is always run
+    return False, digest
+  cached=None  if hashes is None else  hashes.get('\t'.join(outputs))
+  if not cached is None and not digest is None:
+    # inputs unchanged since the line was put in a job, and outputs produced after that
+    return (digest==cached[0] and min(output_times)>=cached[1]), digest
+  input_times=[mtime(path) for path in inputs]
+  if None in input_times:
+    return False, digest
+  return (not input_times or min(output_times)>=max(input_times)), digest
+
+def up_to_date_lines(lines, hashes=None, workers=32, batch_size=10000):
+  """ Takes an iterable of tuples (line_index, outputs, inputs), with lists of file paths, and checks which command lines
+  are up to date, using a pool of threads so that file system calls (e.g. on NFS) overlap. Returns a set of line indices.
+  If hashes (a dict as returned by read_hashes) is provided, inputs are compared by content, and hashes is updated with
+  the current hash of the inputs of lines which are not up to date, since they are going to be run """
+  up_to_date=set()
+  now=time.time()
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    for batch in chunked(lines, batch_size):
+      results=executor.map(lambda line: check_line(line[1], line[2], hashes), batch)
+      for (line_index, outputs, _), (is_up_to_date, digest) in zip(batch, results):
+        if is_up_to_date:
+          up_to_date.add(line_index)
+        elif not hashes is None and not digest is None and outputs:
+          hashes['\t'.join(outputs)]=(digest, now)
+  return up_to_date
@@ -0,0 +1,38 @@
+from qjob.accounting import parse_duration, parse_size_gb, split_slurm_job_id, iter_qacct_records, percentile, format_time_limit
+
+def test_parse_duration():
+  assert parse_duration('1-02:03:04')==93784
+  assert parse_duration('02:03:04')==7384
+  assert parse_duration('03:04.5')==184.5
+  assert parse_duration('123.5s')==123.5
+  assert parse_duration('')==0
+
+def test_parse_size_gb():
+  assert parse_size_gb('1024M')==1
+  assert parse_size_gb('1048576K')==1
+  assert parse_size_gb('2.5G')==2.5
+  assert parse_size_gb(str(3*1024**3))==3
+  assert parse_size_gb('')==0
+
+def test_split_slurm_job_id():
+  assert split_slurm_job_id('123')==('123', None, None)
+  assert split_slurm_job_id('123_4.batch')==('123', 4, 'batch')
+  assert split_slurm_job_id('123.extern')==('123', None, 'extern')
+  assert split_slurm_job_id('123_[5-10]')==('123', None, None)
+
+def test_qacct_records():
+  text=('==============================================================\n'
+        'qname        all.q\njobnumber    55\ntaskid       3\nmaxvmem      1.5G\n'
+        '==============================================================\n'
+        'jobnumber    56\ntaskid       undefined\nfailed       100 : assumedly after job\n')
+  records=list(iter_qacct_records(text))
+  assert records==[{'qname':'all.q', 'jobnumber':'55', 'taskid':'3', 'maxvmem':'1.5G'},
+                   {'jobnumber':'56', 'taskid':'undefined', 'failed':'100 : assumedly after job'}]
+  assert list(iter_qacct_records(''))==[]
+
+def test_percentile_and_time_limit():
+  assert percentile([4, 1, 3, 2], 50)==2.5
+  assert percentile([7], 95)==7
+  assert format_time_limit(30)=='1m'
+  assert format_time_limit(119*60)=='119m'
+  assert format_time_limit(3*3600+1)=='4'
@@ -0,0 +1,16 @@
+from qjob.cli import split_annotations, iter_direct_lines
+
+def test_trailing_annotations():
+  assert split_annotations('echo a  #qjob sec=3 mem=2')==('echo a', {'sec':'3', 'mem':'2'})
+  assert split_annotations('echo a\t#qjob sec=')==('echo a', {'sec':''})
+
+def test_marker_inside_command_is_kept():
+  for line in ['echo "#qjob w"', 'grep "#qjob " f', 'echo a #qjob not annotations', 'echo a#qjob sec=3']:
+    assert split_annotations(line)==(line, {})
+  assert split_annotations('echo "#qjob w" #qjob sec=1')==('echo "#qjob w"', {'sec':'1'})
+
+def test_lines_kept_unless_stripping():
+  lines=['# comment\n', '\n', 'echo a  #qjob sec=3\n', 'grep "#qjob " f\n']
+  assert list(iter_direct_lines(lines))==['echo a  #qjob sec=3', 'grep "#qjob " f']
+  assert list(iter_direct_lines(lines, strip_annotations=True))==['echo a', 'grep "#qjob " f']
+  assert list(iter_direct_lines(lines, annotations=True))==[{'sec':'3'}, {}]
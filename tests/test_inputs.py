@@ -0,0 +1,35 @@
+import gzip, bz2, lzma, shutil, subprocess
+import pytest
+from easyterm import NoTracebackError
+from qjob.cli import iter_direct_lines
+from qjob.inputs import count_lines, open_input, _ZstdPipe
+
+text='\n'.join(['name\tn', 'a\t1', '', '   ', '# c\t2', 'b\t3', '  #x', 'c\t4']) + '\n'
+
+# lines broken by \r alone, or only made of whitespace that bytes regexes don't recognize as such
+tricky_texts=['echo 1\recho 2\necho 3\necho 4\n', 'name\r\na\r\n\r\nb\r\n', 'name\n\u00a0\na\n', 'name\n\x1c \n\x1f#a\nb\n']
+
+@pytest.mark.parametrize('compress', ['', '.gz', '.bz2', '.xz'])
+def test_count_lines_as_iterators(tmp_path, compress):
+  openers={'':open, '.gz':gzip.open, '.bz2':bz2.open, '.xz':lzma.open}
+  for content in [text, text.rstrip('\n'), '', 'header only'] + tricky_texts:
+    path=str(tmp_path/('t.tsv'+compress))
+    with openers[compress](path, 'wt', newline='') as fh:
+      fh.write(content)
+    with open_input(path) as fh:
+      lines=list(fh)
+    assert count_lines(path, skip_comments=True)==sum(1 for _ in iter_direct_lines(lines))
+    assert count_lines(path, skip_header=True)==sum(1 for line in lines[1:] if line.strip())
+
+@pytest.mark.skipif(shutil.which('zstd') is None, reason='zstd program not installed')
+def test_zstd_pipe_errors(tmp_path):
+  path=tmp_path/'t.sh'
+  path.write_text(''.join([f'echo {i}\n' for i in range(100000)]))
+  subprocess.run(['zstd', '-q', str(path)], check=True)
+  data=(tmp_path/'t.sh.zst').read_bytes()
+  with _ZstdPipe(str(tmp_path/'t.sh.zst')) as fh:
+    assert fh.readline()=='echo 0\n'         # stopping early is not an error
+  (tmp_path/'cut.sh.zst').write_bytes(data[:len(data)//2])
+  with pytest.raises(NoTracebackError):
+    with _ZstdPipe(str(tmp_path/'cut.sh.zst')) as fh:
+      list(fh)
@@ -0,0 +1,6 @@
+from qjob.jobdb import expand_task_ranges
+
+def test_expand_task_ranges():
+  assert expand_task_ranges('4-10:2')==[4, 6, 8, 10]
+  assert expand_task_ranges('1,3,5-6:1')==[1, 3, 5, 6]
+  assert expand_task_ranges('7')==[7]
@@ -0,0 +1,21 @@
+import random
+from qjob.cli import pack_by_cost
+
+def test_pack_by_cost():
+  jobs, loads=pack_by_cost([5, 1, 4, 2, 3], 2)
+  assert sorted([i for job in jobs for i in job])==list(range(5))   # every line once
+  assert all(job==sorted(job) for job in jobs)                       # input order kept within jobs
+  assert loads==[sum([5, 1, 4, 2, 3][i] for i in job) for job in jobs]
+  assert max(loads)==8
+
+def test_pack_by_cost_more_jobs_than_lines():
+  jobs, loads=pack_by_cost([2.0, 1.0], 5)
+  assert jobs==[[0], [1]] and loads==[2.0, 1.0]
+
+def test_pack_by_cost_bound():
+  rnd=random.Random(1)
+  costs=[rnd.uniform(0, 100) for _ in range(500)]
+  jobs, loads=pack_by_cost(costs, 13)
+  assert len(jobs)==13
+  # greedy LPT is within 4/3 of the optimum, which is at least the mean load and the max cost
+  assert max(loads) <= 4/3*max(sum(costs)/13, max(costs)) + 1e-9
@@ -0,0 +1,25 @@
+import glob
+import pytest
+from qjob.cli import main, def_opt
+
+def run_local(folder, **options):
+  """ Writes and runs jobs with -sys local, in the way benchmarks/bench_qjob.py calls qjob """
+  opt=dict(def_opt)
+  opt.update({'sys':'local', 'o':folder, 'f':True, 'q':'0', 'E':'', 'qsub':True})
+  opt.update(options)
+  main(opt)
+  return folder+'.jbs'
+
+@pytest.mark.parametrize('sl', [False, True])
+def test_packed_shards_run_locally(tmp_path, monkeypatch, sl):
+  monkeypatch.chdir(tmp_path)
+  outputs=[tmp_path/f'out{i}' for i in range(7)]
+  with open('commands.sh', 'w') as ofh:
+    for i, path in enumerate(outputs):
+      ofh.write(f'echo {i} > {path}\n')
+  folder=run_local('shards', i='commands.sh', pack=True, shard=2, sl=sl)
+  assert len(glob.glob(f'{folder}/jobs/*/')) == 4
+  for i, path in enumerate(outputs):
+    assert path.read_text()==f'{i}\n'
+  # without -sl, the output of each job goes to log files next to its body
+  assert len(glob.glob(f'{folder}/jobs/*/shards.*.LOG')) == (0 if sl else 7)
@@ -0,0 +1,15 @@
+import pytest
+from easyterm import NoTracebackError
+from more_itertools import divide
+from qjob.cli import split_in_jobs
+
+@pytest.mark.parametrize('n_lines, n_jobs', [(10, 3), (10, 10), (3, 10), (1, 1), (100, 7)])
+def test_split_in_jobs_as_divide(n_lines, n_jobs):
+  lines=list(range(n_lines))
+  expected=[list(job) for job in divide(min(n_jobs, n_lines), lines)]
+  assert [list(job) for job in split_in_jobs(iter(lines), n_lines, n_jobs)]==expected
+
+@pytest.mark.parametrize('n_lines, tot_lines', [(9, 10), (11, 10), (5, 0), (2, 10)])
+def test_split_in_jobs_with_wrong_count(n_lines, tot_lines):
+  with pytest.raises(NoTracebackError):
+    list(split_in_jobs(iter(range(n_lines)), tot_lines, 3))
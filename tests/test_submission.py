@@ -0,0 +1,7 @@
+from qjob.submission import submit_jobs
+
+def test_invalid_options_are_failed_submissions():
+  results=list( submit_jobs(['a.sh', 'b.sh'], 'slurm', '--x "y', workers=1) )
+  assert [r.job_id for r in results]==[None, None]
+  assert results[0].attempts==1 and 'No closing quotation' in results[0].error
+  assert results[1].attempts==0      # not attempted after the first failure
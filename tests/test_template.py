@@ -0,0 +1,36 @@
+import pytest
+from qjob.template import compile_template
+
+fields=['name', 'n', 'path']
+rows=[ ['A', '3', '/data/a b'], ['100%', '-1', "it's"], ['', '0', '%s %d %%'] ]
+
+@pytest.mark.parametrize('template', [
+  'run {name} -n {n} -o {path}',            # plain substitutions
+  'echo {name}',                            # a single one
+  '{name}{name}{n}',                        # repeated fields
+  'echo 50% done {name} %s %(n)s',          # % in the template
+  'echo no placeholders',
+  'echo {{literal}} {name}',                # escaped braces
+  'echo {name!r} {path!s} {n!a}',           # conversions
+  'echo {name:>8} {n:<3}|',                 # format specs
+  'echo {name!r:^12}',                      # both
+  ])
+def test_same_as_format(template):
+  render=compile_template(template, fields)
+  for row in rows:
+    assert render(row)==template.format(**dict(zip(fields, row)))
+
+@pytest.mark.parametrize('template', [
+  'echo {path[0]} {name.upper}',            # indexes and attributes
+  'echo {name:>{n}}',                       # nested placeholders
+  ])
+def test_fallback_same_as_format(template):
+  render=compile_template(template, fields)
+  for row in rows[:1]:
+    assert render(row)==template.format(**dict(zip(fields, row)))
+
+def test_errors_as_format():
+  with pytest.raises(ValueError):
+    compile_template('echo {name!x}', fields)
+  with pytest.raises(ValueError):
+    compile_template('echo {n:d}', fields)(['A', '3', 'p'])   # strings cannot take a numeric format spec
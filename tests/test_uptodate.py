@@ -0,0 +1,44 @@
+import os
+from qjob.uptodate import check_line, up_to_date_lines, read_hashes, write_hashes
+
+def touch(path, mtime):
+  with open(path, 'w') as fh:
+    fh.write(os.path.basename(path))
+  os.utime(path, (mtime, mtime))
+  return str(path)
+
+def test_outputs_newer_than_inputs(tmp_path):
+  inp=touch(tmp_path/'a.in', 1000)
+  out=touch(tmp_path/'a.out', 2000)
+  assert check_line([out], [inp])==(True, None)
+  assert check_line([out], [])==(True, None)
+
+def test_outputs_older_or_missing(tmp_path):
+  inp=touch(tmp_path/'a.in', 2000)
+  out=touch(tmp_path/'a.out', 1000)
+  assert check_line([out], [inp])[0] is False
+  assert check_line([str(tmp_path/'missing.out')], [inp])[0] is False
+  assert check_line([out], [str(tmp_path/'missing.in')])[0] is False
+
+def test_no_outputs_is_never_up_to_date(tmp_path):
+  inp=touch(tmp_path/'a.in', 1000)
+  assert check_line([], [inp])[0] is False
+  assert check_line([], [])[0] is False
+  lines=[(0, [], [inp]), (1, [], [])]
+  assert up_to_date_lines(lines, workers=2)==set()
+  hashes={}
+  assert up_to_date_lines(lines, hashes=hashes, workers=2)==set()
+  assert hashes=={}
+
+def test_hashes(tmp_path):
+  inp=touch(tmp_path/'a.in', 5000)
+  out=touch(tmp_path/'a.out', 1000)     # older than input: would be rerun without hashes
+  hashes={}
+  assert up_to_date_lines([(0, [out], [inp])], hashes=hashes)==set()
+  write_hashes(tmp_path, hashes)
+  hashes=read_hashes(tmp_path)
+  os.utime(out)                          # produced after the line was put in a job
+  assert up_to_date_lines([(0, [out], [inp])], hashes=hashes)=={0}
+  with open(inp, 'w') as fh:
+    fh.write('changed')
+  assert up_to_date_lines([(0, [out], [inp])], hashes=hashes)==set()